@@ -0,0 +1,53 @@
+# Микробенчмарк кодеков: JSON по строкам против двоичных кадров со схемой.
+# Замеряет кодирование и разбор типичных сообщений DATA/DELTA обоих серверов.
+# Запуск: python bench_codec.py [число сообщений]
+import sys
+import time
+
+from codec import JSON, BinaryCodec
+
+
+MESSAGES = {
+    "swap": [
+        {"type": "DATA", "version": 1234, "payload": {"swap_total": 4980736000, "swap_free": 4975616000, "ts": 1761236450.105}},
+        {"type": "DELTA", "version": 1235, "base": 1234, "changes": {"swap_free": 4975611904, "ts": 1761236451.160}},
+    ],
+    "screen": [
+        {"type": "DATA", "version": 77, "payload": {"uptime_seconds": 86400, "screen_width": 1920, "screen_height": 1080, "ts": 1761236448.378}},
+        {"type": "DELTA", "version": 78, "base": 77, "changes": {"uptime_seconds": 86401, "ts": 1761236449.401}},
+    ],
+}
+
+
+def bench(codec, messages, n):
+    frames = [codec.encode(m) for m in messages]
+    t0 = time.perf_counter()
+    for _ in range(n):
+        for m in messages:
+            codec.encode(m)
+    enc = time.perf_counter() - t0
+
+    stream = b"".join(frames) * n
+    t0 = time.perf_counter()
+    dec = codec.decoder()
+    dec.feed(stream)
+    count = 0
+    while dec.next_message() is not None:
+        count += 1
+    decode = time.perf_counter() - t0
+    total = n * len(messages)
+    assert count == total
+    return total / enc, total / decode, sum(len(f) for f in frames) / len(frames)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{'схема':8} {'формат':12} {'кодир., сообщ/с':>16} {'разбор, сообщ/с':>16} {'байт/сообщ':>11}")
+    for schema, messages in MESSAGES.items():
+        for codec in (JSON, BinaryCodec(schema)):
+            enc, dec, size = bench(codec, messages, n)
+            print(f"{schema:8} {codec.name:12} {enc:16,.0f} {dec:16,.0f} {size:11.1f}".replace(",", " "))
+
+
+if __name__ == "__main__":
+    main()
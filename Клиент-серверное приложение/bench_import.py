@@ -0,0 +1,46 @@
+# Замер времени запуска безголовой клиентской библиотеки (для встраивания в сборщики).
+# Каждый модуль импортируется в отдельном свежем процессе Python с -X importtime;
+# выводится медиана суммарного времени импорта и признак того, что tkinter не загружался.
+# Запуск: python bench_import.py [число повторов]
+import os
+import sys
+import subprocess
+import statistics
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = ("monitor_client", "client")
+
+
+def import_time(module):
+    """(мкс на импорт module вместе с зависимостями, загружен ли tkinter)."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=BASE, capture_output=True, text=True, check=True).stderr
+    total = None
+    tk_loaded = False
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if name == module:
+            total = int(cumulative)
+        if name == "tkinter":
+            tk_loaded = True
+    return total, tk_loaded
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for module in MODULES:
+        times = []
+        tk_loaded = False
+        for _ in range(n):
+            us, tk = import_time(module)
+            times.append(us)
+            tk_loaded = tk_loaded or tk
+        print(f"{module:16s} медиана {statistics.median(times) / 1e3:7.2f} мс, "
+              f"мин {min(times) / 1e3:7.2f} мс, tkinter: {'да' if tk_loaded else 'нет'}")
+
+
+if __name__ == "__main__":
+    main()
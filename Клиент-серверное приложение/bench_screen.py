@@ -0,0 +1,50 @@
+# Замер стоимости одного такта Server2 на получение разрешения экрана:
+# прежний способ (новый tk.Tk() на каждом такте в цикле событий) против кэша ScreenGeometry.
+# Запуск: python bench_screen.py [число тактов]
+import sys
+import time
+import asyncio
+import tkinter as tk
+
+from server2 import ScreenGeometry
+
+
+def legacy_screen_size():
+    try:
+        root = tk.Tk()
+        root.withdraw()
+        w = root.winfo_screenwidth()
+        h = root.winfo_screenheight()
+        root.destroy()
+        return w, h
+    except Exception:
+        try:
+            import ctypes
+            user32 = ctypes.windll.user32
+            return user32.GetSystemMetrics(0), user32.GetSystemMetrics(1)
+        except Exception:
+            return 1920, 1080
+
+
+async def measure(ticks):
+    t0 = time.perf_counter()
+    for _ in range(ticks):
+        legacy_screen_size()
+    legacy = (time.perf_counter() - t0) / ticks
+
+    screen = ScreenGeometry()
+    await screen.get()  # первый опрос — вне замера, как при старте сервера
+    t0 = time.perf_counter()
+    for _ in range(ticks):
+        await screen.get()
+    cached = (time.perf_counter() - t0) / ticks
+
+    print(f"Тактов: {ticks}")
+    print(f"tk.Tk() на каждом такте: {legacy * 1e3:10.3f} мс/такт")
+    print(f"ScreenGeometry (кэш):    {cached * 1e3:10.6f} мс/такт, опросов экрана: {screen.probes}")
+    if cached:
+        print(f"Ускорение: x{legacy / cached:,.0f}".replace(",", " "))
+
+
+if __name__ == "__main__":
+    asyncio.run(measure(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
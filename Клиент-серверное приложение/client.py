@@ -1,78 +1,132 @@
 import os
 import sys
-import json
 import time
 import threading
 import asyncio
-import tkinter as tk
-from tkinter import ttk
+import collections
+
+from monitor_client import MonitorClient, parse_hostport
+
+# tkinter загружается только при запуске окна: AsyncClient и форматирование работают без Tk
+tk = ttk = None
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(BASE)
 sys.path.insert(0, BASE)
 
 POLL_INTERVAL_DEFAULT = 3
+# Форматы кадров в порядке предпочтения (HELLO). ("json",) — без согласования, как раньше.
+FRAME_FORMATS = ("bin", "json")
+# Сжатие потока (zlib) — имеет смысл на медленных удалённых каналах. () — без сжатия.
+COMPRESSION = ()
+# Обновления из потока asyncio копятся в буфере и применяются к окну раз в UI_FRAME_MS:
+# от s1/s2 остаётся только последнее значение, строки лога вставляются одной пачкой.
+UI_FRAME_MS = 50
+LOG_MAX_LINES = 1000        # строк в окне лога; старые удаляются
+
+class UpdateBuffer:
+    """Потокобезопасный буфер событий для окна: пишет поток asyncio, забирает главный поток Tk."""
+
+    def __init__(self, max_lines=LOG_MAX_LINES):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.lines = collections.deque(maxlen=max_lines)
+        self.dropped = 0
+
+    def put(self, kind, message):
+        with self.lock:
+            if kind == "log":
+                if len(self.lines) == self.lines.maxlen:
+                    self.dropped += 1
+                # время события, а не момента отрисовки
+                self.lines.append(f"[{time.strftime('%H:%M:%S')}] {message}\n")
+            else:
+                self.latest[kind] = message
+
+    def take(self):
+        """(последние значения по видам, строки лога, сколько строк выброшено) с очисткой буфера."""
+        with self.lock:
+            latest, self.latest = self.latest, {}
+            lines = list(self.lines)
+            self.lines.clear()
+            dropped, self.dropped = self.dropped, 0
+        return latest, lines, dropped
+
+
+NAMES = {"s1": "Server1", "s2": "Server2"}
+
+
+def format_uptime(sec):
+    sec = int(sec or 0)
+    days, sec = divmod(sec, 86400)
+    hours, sec = divmod(sec, 3600)
+    minutes, seconds = divmod(sec, 60)
+    parts = []
+    if days:
+        parts.append(f"{days} д")
+    if hours:
+        parts.append(f"{hours} ч")
+    if minutes:
+        parts.append(f"{minutes} мин")
+    parts.append(f"{seconds} с")
+    return " ".join(parts)
+
+
+def fmt_bytes_mb(n):
+    try:
+        n = int(n or 0)
+    except Exception:
+        n = 0
+    mb = n / (1024 * 1024)
+    s = f"{mb:,.2f}".replace(",", " ")
+    return f"{s} МБ"
+
+
+def format_sample(tag, p):
+    """Текст для окна по структурированным данным сервера."""
+    if tag == "s1":
+        total_str = fmt_bytes_mb(p.get("swap_total", 0))
+        free_str = fmt_bytes_mb(p.get("swap_free", 0))
+        return f"Память подкачки — всего: {total_str}  свободно: {free_str}"
+    try:
+        uptime = int(p.get("uptime_seconds", 0) or 0)
+        w = int(p.get("screen_width", 0) or 0)
+        h = int(p.get("screen_height", 0) or 0)
+    except Exception:
+        uptime, w, h = 0, 0, 0
+    screen_str = f"{w}×{h} px" if w and h else "размер экрана неизвестен"
+    return f"Время работы: {format_uptime(uptime)}   Экран: {screen_str}"
 
-def parse_hostport(s: str, default_port: int):
-    if not s:
-        return "localhost", default_port
-    if ":" in s:
-        host, port = s.split(":", 1)
-        try:
-            return host, int(port)
-        except Exception:
-            return host, default_port
-    return s, default_port
 
 class AsyncClient:
+    """Обёртка MonitorClient для окна: свой цикл событий в фоновом потоке и текст для ui_callback."""
+
     def __init__(self, s1_addr, s2_addr, ui_callback, poll_interval=POLL_INTERVAL_DEFAULT):
-        self.s1_addr = s1_addr
-        self.s2_addr = s2_addr
         self.ui_callback = ui_callback
-        self.poll_interval = poll_interval
         self.loop = asyncio.new_event_loop()
-        self.s1_reader = self.s1_writer = None
-        self.s2_reader = self.s2_writer = None
-        self._stop = False
-        self._tasks = []
         self._registered = False
-        self._auto = True
-        self._connected_s1 = False
-        self._connected_s2 = False
+        self.client = MonitorClient({"s1": s1_addr, "s2": s2_addr}, on_data=self._on_data,
+                                    on_status=self._on_status, poll_interval=poll_interval,
+                                    formats=FRAME_FORMATS, compression=COMPRESSION)
 
     def start(self):
         t = threading.Thread(target=self._run, daemon=True)
         t.start()
 
     def stop(self):
-        self._stop = True
-        def _stop_loop():
-            if self._registered:
-                asyncio.run_coroutine_threadsafe(self._do_register(False), self.loop)
-            for w in (self.s1_writer, self.s2_writer):
-                try:
-                    if w:
-                        w.close()
-                except Exception:
-                    pass
-            for t in list(self._tasks):
-                try:
-                    t.cancel()
-                except Exception:
-                    pass
+        async def _shutdown():
             try:
+                await self.client.close()
+            finally:
                 self.loop.stop()
-            except Exception:
-                pass
         if self.loop.is_running():
-            self.loop.call_soon_threadsafe(_stop_loop)
-        else:
-            _stop_loop()
+            asyncio.run_coroutine_threadsafe(_shutdown(), self.loop)
 
     def _run(self):
         asyncio.set_event_loop(self.loop)
         try:
-            self.loop.create_task(self._main())
+            # серверы подключаются кнопками «Подключить»; здесь — только автоопрос
+            self.loop.call_soon(self.client.start, ())
             self.loop.run_forever()
         finally:
             pending = asyncio.all_tasks(loop=self.loop)
@@ -87,249 +141,82 @@ class AsyncClient:
             except Exception:
                 pass
 
-    async def _connect_retry(self, addr, tag):
-        host, port = addr
-        while not self._stop:
-            try:
-                r, w = await asyncio.open_connection(host, port)
-                self.ui_callback("log", f"Подключено к {tag} {host}:{port}")
-                
-                if self._registered:
-                    await self._send(w, {"type": "REGISTER"})
-                
-                if tag == "Server1":
-                    self._connected_s1 = True
-                else:
-                    self._connected_s2 = True
-                return r, w
-            except Exception as e:
-                self.ui_callback("log", f"Ошибка подключения к {tag} {host}:{port}: {e}")
-                await asyncio.sleep(2)
-        return None, None
-
-    async def _disconnect_server(self, tag):
-        if tag == "s1" and self.s1_writer:
-            try:
-                if self._registered:
-                    await self._send(self.s1_writer, {"type": "UNREGISTER"})
-                self.s1_writer.close()
-                await self.s1_writer.wait_closed()
-            except Exception:
-                pass
-            self.s1_reader = self.s1_writer = None
-            self._connected_s1 = False
-            self.ui_callback("log", f"Отключено от Server1")
-        elif tag == "s2" and self.s2_writer:
-            try:
-                if self._registered:
-                    await self._send(self.s2_writer, {"type": "UNREGISTER"})
-                self.s2_writer.close()
-                await self.s2_writer.wait_closed()
-            except Exception:
-                pass
-            self.s2_reader = self.s2_writer = None
-            self._connected_s2 = False
-            self.ui_callback("log", f"Отключено от Server2")
-
-    async def _main(self):
-        if self._connected_s1:
-            self.s1_reader, self.s1_writer = await self._connect_retry(self.s1_addr, "Server1")
-        if self._connected_s2:
-            self.s2_reader, self.s2_writer = await self._connect_retry(self.s2_addr, "Server2")
-
-        if self.s1_reader:
-            self._tasks.append(self.loop.create_task(self._listener(self.s1_reader, "s1")))
-        if self.s2_reader:
-            self._tasks.append(self.loop.create_task(self._listener(self.s2_reader, "s2")))
-        
-        self._tasks.append(self.loop.create_task(self._poller()))
-
-    async def _send(self, writer, obj):
-        try:
-            if writer and not writer.is_closing():
-                writer.write((json.dumps(obj) + "\n").encode("utf-8"))
-                await writer.drain()
-                return True
-        except Exception as e:
-            self.ui_callback("log", f"Ошибка отправки: {e}")
-        return False
-
-    async def _poller(self):
-        while not self._stop:
-            if self._auto and not self._registered:
-                await self._send_poll()
-            await asyncio.sleep(self.poll_interval)
-
-    async def _send_poll(self):
-        if self.s1_writer and self._connected_s1:
-            await self._send(self.s1_writer, {"type":"POLL"})
-        if self.s2_writer and self._connected_s2:
-            await self._send(self.s2_writer, {"type":"POLL"})
-
-    async def _listener(self, reader, tag):
-        def format_uptime(sec):
-            sec = int(sec or 0)
-            days, sec = divmod(sec, 86400)
-            hours, sec = divmod(sec, 3600)
-            minutes, seconds = divmod(sec, 60)
-            parts = []
-            if days:
-                parts.append(f"{days} д")
-            if hours:
-                parts.append(f"{hours} ч")
-            if minutes:
-                parts.append(f"{minutes} мин")
-            parts.append(f"{seconds} с")
-            return " ".join(parts)
-
-        def fmt_bytes_mb(n):
-            try:
-                n = int(n or 0)
-            except Exception:
-                n = 0
-            mb = n / (1024 * 1024)
-            s = f"{mb:,.2f}".replace(",", " ")
-            return f"{s} МБ"
-
-        while not self._stop:
-            try:
-                line = await reader.readline()
-                if not line:
-                    self.ui_callback("log", f"{tag} отключился")
-                    if tag == "s1":
-                        self._connected_s1 = False
-                    else:
-                        self._connected_s2 = False
-                    break
-                
-                try:
-                    msg = json.loads(line.decode("utf-8").strip())
-                except Exception:
-                    continue
-                
-                if msg.get("type") == "DATA":
-                    p = msg.get("payload", {})
-                    if tag == "s1":
-                        total = p.get("swap_total", 0)
-                        free = p.get("swap_free", 0)
-                        total_str = fmt_bytes_mb(total)
-                        free_str = fmt_bytes_mb(free)
-                        txt = f"Память подкачки — всего: {total_str}  свободно: {free_str}"
-                        self.ui_callback("s1", txt)
-                    elif tag == "s2":
-                        uptime = p.get("uptime_seconds", 0)
-                        w = p.get("screen_width", 0)
-                        h = p.get("screen_height", 0)
-                        try:
-                            uptime = int(uptime or 0)
-                            w = int(w or 0)
-                            h = int(h or 0)
-                        except Exception:
-                            uptime, w, h = 0, 0, 0
-                        uptime_str = format_uptime(uptime)
-                        screen_str = f"{w}×{h} px" if w and h else "размер экрана неизвестен"
-                        txt = f"Время работы: {uptime_str}   Экран: {screen_str}"
-                        self.ui_callback("s2", txt)
-                
-                elif msg.get("type") == "ACK":
-                    message = msg.get('message', '')
-                    self.ui_callback("log", f"{message}")
-                    
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                self.ui_callback("log", f"Listener {tag} ошибка: {e}")
-                if tag == "s1":
-                    self._connected_s1 = False
-                else:
-                    self._connected_s2 = False
-                break
-
-        if not self._stop:
-            self.ui_callback("log", f"Попытка переподключения к {tag}")
-            if tag == "s1" and self._connected_s1:
-                self.s1_reader, self.s1_writer = await self._connect_retry(self.s1_addr, "Server1")
-                if self.s1_reader:
-                    self._tasks.append(self.loop.create_task(self._listener(self.s1_reader, "s1")))
-            elif tag == "s2" and self._connected_s2:
-                self.s2_reader, self.s2_writer = await self._connect_retry(self.s2_addr, "Server2")
-                if self.s2_reader:
-                    self._tasks.append(self.loop.create_task(self._listener(self.s2_reader, "s2")))
+    def _on_data(self, sample):
+        self.ui_callback(sample.tag, format_sample(sample.tag, sample.payload))
+
+    def _on_status(self, tag, status, detail):
+        name = NAMES.get(tag, tag)
+        if status == "connected":
+            self.ui_callback("log", f"Подключено к {name} {detail['host']}:{detail['port']}")
+            if detail["codec"] != "json" or detail["compress"]:
+                zipped = ", zlib" if detail["compress"] else ""
+                self.ui_callback("log", f"{name}: формат кадров {detail['codec']}{zipped}")
+        elif status == "hello_timeout":
+            self.ui_callback("log", f"{name}: сервер не ответил на HELLO, используется JSON")
+        elif status == "error":
+            self.ui_callback("log", f"Ошибка соединения с {name} {detail}")
+        elif status == "disconnected":
+            self.ui_callback("log", f"{tag} отключился, попытка переподключения")
+        elif status == "closed":
+            self.ui_callback("log", f"Отключено от {name}")
+        elif status == "message" and detail.get("type") == "ACK":
+            self.ui_callback("log", f"{detail.get('message', '')}")
+
+    def _call(self, coro_or_fn, *args):
+        if asyncio.iscoroutine(coro_or_fn):
+            asyncio.run_coroutine_threadsafe(coro_or_fn, self.loop)
+        else:
+            self.loop.call_soon_threadsafe(coro_or_fn, *args)
 
     def connect_server(self, which):
-        if which == "s1" and not self._connected_s1:
-            self._connected_s1 = True
-            asyncio.run_coroutine_threadsafe(self._reconnect_server("s1"), self.loop)
-            self.ui_callback("log", "Подключаем Server1...")
-        elif which == "s2" and not self._connected_s2:
-            self._connected_s2 = True
-            asyncio.run_coroutine_threadsafe(self._reconnect_server("s2"), self.loop)
-            self.ui_callback("log", "Подключаем Server2...")
+        if not self.client.links[which].active:
+            self._call(self.client.connect, which)
+            self.ui_callback("log", f"Подключаем {NAMES[which]}...")
 
     def disconnect_server(self, which):
-        if which == "s1" and self._connected_s1:
-            self._connected_s1 = False
-            asyncio.run_coroutine_threadsafe(self._disconnect_server("s1"), self.loop)
-        elif which == "s2" and self._connected_s2:
-            self._connected_s2 = False
-            asyncio.run_coroutine_threadsafe(self._disconnect_server("s2"), self.loop)
-
-    async def _reconnect_server(self, tag):
-        if tag == "s1":
-            self.s1_reader, self.s1_writer = await self._connect_retry(self.s1_addr, "Server1")
-            if self.s1_reader:
-                self._tasks.append(self.loop.create_task(self._listener(self.s1_reader, "s1")))
-        else:
-            self.s2_reader, self.s2_writer = await self._connect_retry(self.s2_addr, "Server2")
-            if self.s2_reader:
-                self._tasks.append(self.loop.create_task(self._listener(self.s2_reader, "s2")))
+        if self.client.links[which].active:
+            self._call(self.client.disconnect(which))
 
     def toggle_register(self):
-        if not self._connected_s1 or not self._connected_s2:
+        if not all(link.connected for link in self.client.links.values()):
             self.ui_callback("log", "Нельзя подписаться: не все серверы подключены")
             return self._registered
-        
+
         new_state = not self._registered
         self._registered = new_state
-        
-        asyncio.run_coroutine_threadsafe(self._do_register(new_state), self.loop)
-        
+
+        self._call(self._do_register(new_state))
+
         self.ui_callback("log", f"{'Подписываемся' if new_state else 'Отписываемся'} на push-уведомления...")
         return new_state
 
     async def _do_register(self, register: bool):
-        command = "REGISTER" if register else "UNREGISTER"
-        success_count = 0
-        
-        if self.s1_writer and self._connected_s1:
-            if await self._send(self.s1_writer, {"type": command}):
-                success_count += 1
-        
-        if self.s2_writer and self._connected_s2:
-            if await self._send(self.s2_writer, {"type": command}):
-                success_count += 1
-        
+        success_count = await self.client.subscribe(register)
         if success_count > 0:
             self.ui_callback("log", f"{'Подписка оформлена' if register else 'Подписка отменена'} на {success_count} серверов")
         else:
             self.ui_callback("log", f"Не удалось {'подписаться' if register else 'отписаться'}")
 
     def set_auto(self, flag: bool):
-        self._auto = bool(flag)
+        self.client.auto_poll = bool(flag)
 
     def set_interval(self, sec: int):
         try:
-            self.poll_interval = max(1, int(sec))
+            self.client.poll_interval = max(1, int(sec))
         except Exception:
-            self.poll_interval = POLL_INTERVAL_DEFAULT
+            self.client.poll_interval = POLL_INTERVAL_DEFAULT
 
     def update_addresses(self, s1_addr, s2_addr):
-        self.s1_addr = s1_addr
-        self.s2_addr = s2_addr
+        # новые адреса используются при следующем подключении
+        self.client.links["s1"].addr = s1_addr
+        self.client.links["s2"].addr = s2_addr
 
 class ClientUI:
-    def __init__(self, root):
+    def __init__(self, root, log_max_lines=LOG_MAX_LINES):
+        load_tk()
         self.root = root
+        self.log_max_lines = log_max_lines
+        self.updates = UpdateBuffer(log_max_lines)
         root.title("Клиент мониторинга системы (Linux)")
         
         # Установка размера шрифта для лучшей читаемости в Linux
@@ -410,6 +297,7 @@ class ClientUI:
         self.client.start()
 
         root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(UI_FRAME_MS, self._drain_updates)
 
     def apply_settings(self):
         s1 = parse_hostport(self.s1_entry.get(), 8081)
@@ -424,16 +312,30 @@ class ClientUI:
         self.ui_callback("log", f"Применены новые настройки")
 
     def ui_callback(self, kind, message):
-        if kind == "s1":
-            self.root.after(0, self.s1_var.set, message)
-        elif kind == "s2":
-            self.root.after(0, self.s2_var.set, message)
-        elif kind == "log":
-            self.root.after(0, self._append_log, message)
-
-    def _append_log(self, msg):
-        ts = time.strftime("%H:%M:%S")
-        self.log_box.insert("end", f"[{ts}] {msg}\n")
+        # вызывается из любого потока: только кладёт событие в буфер
+        self.updates.put(kind, message)
+
+    def _drain_updates(self):
+        # раз в кадр: применяем накопленное и планируем следующий проход
+        try:
+            latest, lines, dropped = self.updates.take()
+            if "s1" in latest:
+                self.s1_var.set(latest["s1"])
+            if "s2" in latest:
+                self.s2_var.set(latest["s2"])
+            if dropped:
+                lines.insert(0, f"[{time.strftime('%H:%M:%S')}] ... пропущено строк лога: {dropped}\n")
+            if lines:
+                self._append_log_lines(lines)
+        finally:
+            self.root.after(UI_FRAME_MS, self._drain_updates)
+
+    def _append_log_lines(self, lines):
+        self.log_box.insert("end", "".join(lines))
+        # "end-1c" — позиция после последнего перевода строки: номер строки = их число + 1
+        count = int(self.log_box.index("end-1c").split(".")[0]) - 1
+        if count > self.log_max_lines:
+            self.log_box.delete("1.0", f"{count - self.log_max_lines + 1}.0")
         self.log_box.see("end")
 
     def on_toggle_register(self):
@@ -452,7 +354,17 @@ class ClientUI:
             pass
         self.root.after(200, self.root.destroy)
 
+def load_tk():
+    global tk, ttk
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as _ttk
+        tk, ttk = tkinter, _ttk
+    return tk
+
+
 def main():
+    load_tk()
     root = tk.Tk()
     app = ClientUI(root)
     root.mainloop()
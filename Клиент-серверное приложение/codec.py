@@ -0,0 +1,399 @@
+# Кодеки протокола клиент <-> сервер: JSON по строкам (по умолчанию) и компактные двоичные кадры.
+# Пояснение: клиент может первым сообщением прислать {"type":"HELLO","formats":["bin","json"]};
+# сервер отвечает JSON-строкой HELLO с выбранным форматом, и после этого обе стороны
+# переключаются. Двоичный кадр — заголовок struct "!IB" (длина тела, вид сообщения) и тело.
+# Для DATA/DELTA/NOT_MODIFIED/POLL тело упаковано по фиксированной схеме полей сервера,
+# остальные сообщения (ACK, REGISTER и т.п.) передаются как JSON внутри двоичного кадра.
+# В HELLO можно также запросить "compress": ["zlib"] — тогда поверх выбранного формата идёт
+# один непрерывный поток zlib на соединение с Z_SYNC_FLUSH после каждого кадра: словарь
+# компрессора сохраняется между сообщениями, и повторяющиеся ключи почти ничего не стоят.
+# Входящий поток распаковывается порциями не больше одного кадра (INFLATE_LIMIT), поэтому
+# несколько КБ сжатых данных не могут развернуться в сотни МБ до проверки MAX_FRAME.
+# Несколько команд можно прислать одной строкой как JSON-массив; recv_batch() отдаёт серверу
+# все уже полученные команды сразу, чтобы ответы ушли одной записью.
+import json
+import time
+import zlib
+import struct
+import asyncio
+import collections
+
+READ_CHUNK = 64 * 1024
+MAX_FRAME = 1024 * 1024
+HELLO_TIMEOUT = 3.0
+COMPRESS_LEVEL = 6
+COMPRESSIONS = ("zlib",)
+
+# Схемы полей payload: имя поля -> код struct. ts — время выборки (double).
+SCHEMAS = {
+    "swap": (("swap_total", "Q"), ("swap_free", "Q"), ("ts", "d")),
+    "screen": (("uptime_seconds", "Q"), ("screen_width", "I"), ("screen_height", "I"), ("ts", "d")),
+}
+
+KIND_JSON = 0
+KIND_DATA = 1
+KIND_DELTA = 2
+KIND_NOT_MODIFIED = 3
+KIND_POLL = 4
+
+HEADER = struct.Struct("!IB")
+# сколько распакованных байт может ждать разбора: самый длинный кадр с заголовком (или строка с \n)
+INFLATE_LIMIT = MAX_FRAME + HEADER.size + 1
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode(self, obj):
+        return (json.dumps(obj) + "\n").encode("utf-8")
+
+    def decoder(self):
+        return JsonDecoder()
+
+
+class JsonDecoder:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+
+    def take_buffer(self):
+        rest, self.buf = bytes(self.buf), bytearray()
+        return rest
+
+    def next_message(self):
+        return self.next_frame()[0]
+
+    def next_frame(self):
+        """(сообщение, исходные байты кадра) или (None, None), если полного кадра ещё нет."""
+        # Некорректные строки пропускаются, как и раньше
+        while True:
+            i = self.buf.find(b"\n")
+            if i < 0:
+                if len(self.buf) > MAX_FRAME:
+                    raise ProtocolError("слишком длинная строка")
+                return None, None
+            raw = bytes(self.buf[:i + 1])
+            del self.buf[:i + 1]
+            try:
+                msg = json.loads(raw.decode("utf-8").strip())
+            except Exception:
+                continue
+            # список команд разворачивает Connection
+            if isinstance(msg, (dict, list)):
+                return msg, raw
+
+
+class BinaryCodec:
+    def __init__(self, schema):
+        self.schema = schema
+        self.name = f"bin:{schema}"
+        fields = SCHEMAS[schema]
+        self.fields = [f for f, _ in fields]
+        self.field_structs = [struct.Struct("!" + c) for _, c in fields]
+        self.data = struct.Struct("!Q" + "".join(c for _, c in fields))
+        self.delta_head = struct.Struct("!QQH")
+        self.version = struct.Struct("!Q")
+        self.poll = struct.Struct("!QB")
+
+    def _frame(self, kind, body):
+        return HEADER.pack(len(body), kind) + body
+
+    def encode(self, obj):
+        t = obj.get("type")
+        try:
+            if t == "DATA":
+                p = obj["payload"]
+                return self._frame(KIND_DATA, self.data.pack(obj.get("version", 0), *(p[f] for f in self.fields)))
+            if t == "DELTA":
+                changes = obj["changes"]
+                mask = 0
+                values = []
+                for i, f in enumerate(self.fields):
+                    if f in changes:
+                        mask |= 1 << i
+                        values.append(self.field_structs[i].pack(changes[f]))
+                if len(changes) == len(values):
+                    head = self.delta_head.pack(obj.get("version", 0), obj.get("base", 0), mask)
+                    return self._frame(KIND_DELTA, head + b"".join(values))
+            elif t == "NOT_MODIFIED":
+                return self._frame(KIND_NOT_MODIFIED, self.version.pack(obj.get("version", 0)))
+            elif t == "POLL" and set(obj) <= {"type", "version", "delta"}:
+                return self._frame(KIND_POLL, self.poll.pack(obj.get("version", 0), 1 if obj.get("delta") else 0))
+        except (KeyError, TypeError, struct.error):
+            pass
+        # всё, что не укладывается в схему, уходит как JSON внутри кадра
+        return self._frame(KIND_JSON, json.dumps(obj).encode("utf-8"))
+
+    def decode(self, kind, body):
+        if kind == KIND_DATA:
+            values = self.data.unpack(body)
+            return {"type": "DATA", "version": values[0], "payload": dict(zip(self.fields, values[1:]))}
+        if kind == KIND_DELTA:
+            version, base, mask = self.delta_head.unpack_from(body)
+            offset = self.delta_head.size
+            changes = {}
+            for i, f in enumerate(self.fields):
+                if mask & (1 << i):
+                    st = self.field_structs[i]
+                    changes[f], = st.unpack_from(body, offset)
+                    offset += st.size
+            return {"type": "DELTA", "version": version, "base": base, "changes": changes}
+        if kind == KIND_NOT_MODIFIED:
+            return {"type": "NOT_MODIFIED", "version": self.version.unpack(body)[0]}
+        if kind == KIND_POLL:
+            version, flags = self.poll.unpack(body)
+            return {"type": "POLL", "version": version, "delta": bool(flags & 1)}
+        if kind == KIND_JSON:
+            return json.loads(body.decode("utf-8"))
+        raise ProtocolError(f"неизвестный вид кадра {kind}")
+
+    def decoder(self):
+        return BinaryDecoder(self)
+
+
+class BinaryDecoder:
+    def __init__(self, codec):
+        self.codec = codec
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+
+    def take_buffer(self):
+        rest, self.buf = bytes(self.buf), bytearray()
+        return rest
+
+    def next_message(self):
+        return self.next_frame()[0]
+
+    def next_frame(self):
+        if len(self.buf) < HEADER.size:
+            return None, None
+        length, kind = HEADER.unpack_from(self.buf)
+        if length > MAX_FRAME:
+            raise ProtocolError("слишком большой кадр")
+        end = HEADER.size + length
+        if len(self.buf) < end:
+            return None, None
+        raw = bytes(self.buf[:end])
+        del self.buf[:end]
+        try:
+            return self.codec.decode(kind, raw[HEADER.size:]), raw
+        except (struct.error, ValueError) as e:
+            raise ProtocolError(f"повреждённый кадр: {e}")
+
+
+JSON = JsonCodec()
+
+
+def make_codec(fmt, schema=None):
+    if fmt == "json":
+        return JSON
+    if fmt == "bin" and schema in SCHEMAS:
+        return BinaryCodec(schema)
+    return None
+
+
+class WireStats:
+    """Счётчики сжатия: сколько байт было до и после zlib и сколько времени на это ушло."""
+
+    def __init__(self):
+        self.frames = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.compress_time = 0.0
+
+    @property
+    def saved(self):
+        return self.raw_bytes - self.wire_bytes
+
+    def snapshot(self):
+        return {"frames": self.frames, "raw_bytes": self.raw_bytes, "wire_bytes": self.wire_bytes,
+                "saved_bytes": self.saved, "compress_ms": round(self.compress_time * 1e3, 3)}
+
+
+class Connection:
+    """Пара reader/writer с текущим кодеком и (необязательно) zlib-сжатием; меняются после HELLO."""
+
+    def __init__(self, reader, writer, codec=JSON, stats=None, metrics=None):
+        self.reader = reader
+        self.writer = writer
+        self.codec = codec
+        self.decoder = codec.decoder()
+        self.compressor = None
+        self.decompressor = None
+        # распакованный вывод мог упереться в INFLATE_LIMIT — остаток ещё в распаковщике
+        self.inflate_more = False
+        # stats — общие счётчики сервера; own_stats — только этого соединения
+        self.stats = stats
+        self.own_stats = WireStats()
+        # metrics — необязательный metrics.ServerMetrics (счётчики отправленных кадров и байт)
+        self.metrics = metrics
+        # команды из уже разобранного JSON-массива
+        self.pending = collections.deque()
+        # кадры, накопленные между cork() и uncork()
+        self.corked = None
+
+    def switch(self, codec, compress=None):
+        # накопленные ответы (в том числе HELLO) уходят ещё без нового сжатия
+        corked = self.corked is not None
+        self.uncork()
+        if corked:
+            self.cork()
+        # байты, пришедшие после HELLO, уже относятся к новому формату
+        rest = self.decoder.take_buffer()
+        self.codec = codec
+        self.decoder = codec.decoder()
+        if compress == "zlib":
+            self.compressor = zlib.compressobj(COMPRESS_LEVEL)
+            self.decompressor = zlib.decompressobj()
+            self._inflate(rest)
+        else:
+            self.decoder.feed(rest)
+
+    def _inflate(self, data):
+        """Распаковка не больше, чем помещается в буфер разбора; остальное — в unconsumed_tail."""
+        room = INFLATE_LIMIT - len(self.decoder.buf)
+        if room <= 0:
+            raise ProtocolError("слишком большой кадр")
+        out = self.decompressor.decompress(self.decompressor.unconsumed_tail + data, room)
+        self.inflate_more = len(out) == room or bool(self.decompressor.unconsumed_tail)
+        self.decoder.feed(out)
+
+    def encode(self, obj):
+        return self.codec.encode(obj)
+
+    def cork(self):
+        """Дальнейшие кадры копятся в памяти до uncork() и уходят в сокет одной записью."""
+        if self.corked is None:
+            self.corked = []
+
+    def uncork(self):
+        frames, self.corked = self.corked, None
+        if frames:
+            self.write_frame(b"".join(frames), len(frames))
+
+    def write_frame(self, frame, frames=1):
+        """Запись уже закодированного кадра (с учётом сжатия соединения)."""
+        if self.corked is not None:
+            self.corked.append(frame)
+            return
+        if self.compressor is not None:
+            t0 = time.perf_counter()
+            raw = len(frame)
+            frame = self.compressor.compress(frame) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            elapsed = time.perf_counter() - t0
+            for st in (self.own_stats, self.stats):
+                if st is not None:
+                    st.frames += frames
+                    st.raw_bytes += raw
+                    st.wire_bytes += len(frame)
+                    st.compress_time += elapsed
+        if self.metrics is not None:
+            self.metrics.count_frame(len(frame), frames)
+        self.writer.write(frame)
+
+    def write(self, obj):
+        self.write_frame(self.codec.encode(obj))
+
+    def write_many(self, objs):
+        """Несколько сообщений одной записью в сокет (и одним блоком сжатия)."""
+        self.cork()
+        for obj in objs:
+            self.write(obj)
+        self.uncork()
+
+    async def send(self, obj):
+        self.write(obj)
+        await self.writer.drain()
+
+    def _next_frame(self):
+        while not self.pending:
+            msg, raw = self.decoder.next_frame()
+            if msg is None:
+                return None, None
+            if isinstance(msg, dict):
+                return msg, raw
+            if isinstance(msg, list):
+                self.pending.extend(m for m in msg if isinstance(m, dict))
+        # у команд из массива нет отдельного кадра
+        return self.pending.popleft(), None
+
+    def _next_decoded(self):
+        return self._next_frame()[0]
+
+    def ready(self):
+        """Все уже полученные сообщения без ожидания сокета. Останавливается после HELLO:
+        следующие за ним байты относятся к новому формату."""
+        batch = []
+        while not batch or batch[-1].get("type") != "HELLO":
+            msg = self._next_decoded()
+            if msg is None:
+                break
+            batch.append(msg)
+        return batch
+
+    async def recv_batch(self):
+        """Непустой список сообщений или [], если соединение закрыто."""
+        msg = await self.recv()
+        if msg is None:
+            return []
+        if msg.get("type") == "HELLO":
+            return [msg]
+        return [msg] + self.ready()
+
+    async def recv(self):
+        """Следующее сообщение (dict) или None, если соединение закрыто."""
+        return (await self.recv_frame())[0]
+
+    async def recv_frame(self):
+        """(сообщение, исходный кадр без сжатия) — для пересылки кадра без повторного кодирования.
+        (None, None), если соединение закрыто."""
+        while True:
+            msg, raw = self._next_frame()
+            if msg is not None:
+                return msg, raw
+            if self.inflate_more:
+                # сначала разбираем то, что уже получено, но ещё не распаковано
+                self._inflate(b"")
+                continue
+            data = await self.reader.read(READ_CHUNK)
+            if not data:
+                return None, None
+            if self.decompressor is not None:
+                self._inflate(data)
+            else:
+                self.decoder.feed(data)
+
+
+def server_hello(msg, schema):
+    """Выбор формата и сжатия по HELLO клиента. Возвращает (ответ, новый кодек, сжатие или None).
+    ValueError — если formats или compress не списки."""
+    formats = msg.get("formats", ["json"])
+    compressions = msg.get("compress", [])
+    if not isinstance(formats, list) or not isinstance(compressions, list):
+        raise ValueError("formats и compress должны быть списками")
+    compress = next((c for c in compressions if c in COMPRESSIONS), None)
+    for fmt in formats:
+        codec = make_codec(fmt, schema)
+        if codec is not None:
+            return {"type": "HELLO", "format": fmt, "schema": schema, "compress": compress}, codec, compress
+    return {"type": "HELLO", "format": "json", "schema": schema, "compress": compress}, JSON, compress
+
+
+async def client_hello(conn, formats, compress=(), timeout=HELLO_TIMEOUT):
+    """Согласование формата со стороны клиента. Старый сервер ответит ACK UNKNOWN — остаёмся на JSON."""
+    await conn.send({"type": "HELLO", "formats": list(formats), "compress": list(compress)})
+    msg = await asyncio.wait_for(conn.recv(), timeout)
+    if msg and msg.get("type") == "HELLO":
+        codec = make_codec(msg.get("format"), msg.get("schema"))
+        mode = msg.get("compress") if msg.get("compress") in COMPRESSIONS else None
+        if codec is not None:
+            conn.switch(codec, mode)
+    return conn.codec
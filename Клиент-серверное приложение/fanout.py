@@ -0,0 +1,280 @@
+# Общий механизм рассылки push-уведомлений подписчикам для Server1 и Server2.
+# Пояснение: кадр DATA кодируется один раз в общий bytes-буфер; у каждого подписчика своя
+# ограниченная очередь и своя задача-писатель, поэтому медленный клиент не задерживает остальных.
+# Для DATA действует правило «побеждает последнее значение»: неотправленный кадр заменяется новым.
+# Подписчик, получивший предыдущую версию, получает короткий DELTA, остальные — полный кадр.
+# REGISTER может ограничить подписку (SubscriptionFilter): список полей, минимальный интервал
+# между кадрами и порог изменения по полям. Версии, не прошедшие фильтр, подписчику не
+# отправляются, а при ограничении частоты неотправленная версия заменяется более свежей.
+# Кадры для одинаковых наборов полей по-прежнему кодируются один раз на всех.
+import time
+import asyncio
+import collections
+
+from codec import JSON
+from sampler import parse_threshold, significant
+
+SEND_QUEUE_MAX = 32        # максимум служебных кадров (ACK и т.п.) в очереди подписчика
+EVICT_AFTER = 10.0         # секунд, которые drain() может ждать клиента до его отключения
+
+
+class SubscriptionFilter:
+    """Условия подписки: поля, минимальный интервал (с) и пороги {поле: число | "N%"}."""
+    __slots__ = ("fields", "min_interval", "thresholds")
+
+    def __init__(self, fields=None, min_interval=0.0, thresholds=None):
+        self.fields = fields
+        self.min_interval = min_interval
+        # поле -> (абсолютный порог, относительный порог), см. sampler.parse_threshold
+        self.thresholds = thresholds or {}
+
+    @classmethod
+    def from_message(cls, msg, known_fields):
+        """Фильтр из REGISTER или None, если подписка без ограничений. ValueError — при ошибке."""
+        fields = msg.get("fields")
+        min_interval = msg.get("min_interval") or 0
+        thresholds = msg.get("thresholds") or {}
+        if fields is None and not min_interval and not thresholds:
+            return None
+        if fields is not None:
+            if not isinstance(fields, list) or not fields:
+                raise ValueError("fields должен быть непустым списком")
+            unknown = [f for f in fields if f not in known_fields]
+            if unknown:
+                raise ValueError(f"неизвестные поля: {unknown}")
+            fields = tuple(sorted(set(fields)))
+        if not isinstance(min_interval, (int, float)) or min_interval < 0:
+            raise ValueError("min_interval должен быть неотрицательным числом")
+        if not isinstance(thresholds, dict):
+            raise ValueError("thresholds должен быть объектом {поле: порог}")
+        parsed = {}
+        for name, value in thresholds.items():
+            if name not in known_fields:
+                raise ValueError(f"неизвестное поле порога: {name}")
+            parsed[name] = parse_threshold(value)
+        return cls(fields, float(min_interval), parsed)
+
+    def passes(self, update, sent):
+        """Достаточно ли update отличается от последней отправленной версии sent."""
+        if sent is None:
+            return True
+        new, old = update.payload, sent.payload
+        return any(significant(old.get(name), new.get(name), self.thresholds.get(name))
+                   for name in self.fields or new if name != "ts")
+
+
+class Update:
+    """Одна версия данных. Кадры DATA и DELTA кодируются лениво, один раз на кодек для всех подписчиков."""
+    __slots__ = ("version", "payload", "changes", "base", "_frames")
+
+    def __init__(self, version, payload, changes=None, base=None):
+        self.version = version
+        self.payload = payload
+        # changes — изменившиеся поля относительно версии base (None — только полный кадр)
+        self.changes = changes
+        self.base = base
+        self._frames = {}
+
+    def full(self, codec=JSON, fields=None):
+        key = ("DATA", codec.name, fields)
+        frame = self._frames.get(key)
+        if frame is None:
+            payload = self.payload
+            if fields is not None:
+                payload = {k: v for k, v in payload.items() if k in fields or k == "ts"}
+            frame = self._frames[key] = codec.encode({"type": "DATA", "version": self.version,
+                                                      "payload": payload})
+        return frame
+
+    def delta(self, codec=JSON):
+        key = ("DELTA", codec.name)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = codec.encode({"type": "DELTA", "version": self.version,
+                                                      "base": self.base, "changes": self.changes})
+        return frame
+
+    def delta_from(self, sent, fields=None, codec=JSON):
+        """DELTA относительно произвольной ранее отправленной версии (для подписок с фильтром)."""
+        key = ("DELTA", codec.name, fields, sent.version)
+        frame = self._frames.get(key)
+        if frame is None:
+            old = sent.payload
+            changes = {k: v for k, v in self.payload.items()
+                       if (fields is None or k in fields or k == "ts") and old.get(k) != v}
+            frame = self._frames[key] = codec.encode({"type": "DELTA", "version": self.version,
+                                                      "base": sent.version, "changes": changes})
+        return frame
+
+    def seed(self, kind, codec, frame):
+        """Готовый кадр DATA или DELTA, полученный от вышестоящего сервера (relay.py):
+        подписчикам с тем же кодеком он уйдёт без повторного кодирования."""
+        key = ("DATA", codec.name, None) if kind == "DATA" else ("DELTA", codec.name)
+        self._frames.setdefault(key, frame)
+
+    def frame_for(self, known_version, accepts_delta, codec=JSON):
+        if accepts_delta and self.changes is not None and known_version == self.base:
+            return self.delta(codec)
+        return self.full(codec)
+
+
+class Subscriber:
+    def __init__(self, fanout, conn, delta=False, filter=None):
+        self.fanout = fanout
+        # conn — codec.Connection: кодек и сжатие берутся из соединения в момент записи
+        self.conn = conn
+        self.writer = conn.writer
+        self.delta = delta
+        self.filter = filter
+        # версия, последней записанная в сокет этого подписчика
+        self.sent_version = None
+        self.sent_update = None
+        self.control = collections.deque()
+        self.latest = None
+        self.wakeup = asyncio.Event()
+        self.sending_since = None
+        self.coalesced = 0
+        self.filtered = 0
+        # не раньше этого момента (monotonic) — следующий кадр данных при min_interval
+        self.next_data_at = 0.0
+        self._timer = None
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def offer_data(self, update):
+        if self.filter is not None and not self.filter.passes(update, self.sent_update):
+            # значение вернулось в пределы порога — отложенная версия тоже больше не нужна
+            self.filtered += 1
+            self.latest = None
+            return
+        if self.latest is not None:
+            self.coalesced += 1
+        self.latest = update
+        if self._timer is None:
+            self.wakeup.set()
+
+    def send_snapshot(self, update):
+        """Текущие данные сразу при подписке: полный кадр пишется немедленно, до ответа на REGISTER."""
+        fields = self.filter.fields if self.filter is not None else None
+        frame = update.full(self.conn.codec, fields)
+        # отложенная версия не новее снимка — больше не нужна
+        self.latest = None
+        self.sent_version = update.version
+        self.sent_update = update
+        if self.filter is not None and self.filter.min_interval:
+            self.next_data_at = time.monotonic() + self.filter.min_interval
+        self.conn.write_frame(frame)
+
+    def offer_control(self, frame):
+        if len(self.control) >= SEND_QUEUE_MAX:
+            return False
+        self.control.append(frame)
+        self.wakeup.set()
+        return True
+
+    def is_stalled(self, now):
+        # Отстающий подписчик: буфер сокета переполнен и drain() не завершается слишком долго
+        return self.sending_since is not None and now - self.sending_since > EVICT_AFTER
+
+    def _frame(self, update):
+        f = self.filter
+        if f is None:
+            return update.frame_for(self.sent_version, self.delta, self.conn.codec)
+        if self.delta and self.sent_update is not None:
+            return update.delta_from(self.sent_update, f.fields, self.conn.codec)
+        return update.full(self.conn.codec, f.fields)
+
+    def _on_timer(self):
+        self._timer = None
+        self.wakeup.set()
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.control or self.latest is not None:
+                    if self.control:
+                        frame = self.control.popleft()
+                    else:
+                        wait = self.next_data_at - time.monotonic()
+                        if wait > 0:
+                            # ограничение частоты: проснёмся по таймеру, новые версии заменят latest
+                            if self._timer is None:
+                                self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+                            break
+                        update, self.latest = self.latest, None
+                        frame = self._frame(update)
+                        self.sent_version = update.version
+                        self.sent_update = update
+                        if self.filter is not None and self.filter.min_interval:
+                            self.next_data_at = time.monotonic() + self.filter.min_interval
+                    self.sending_since = time.monotonic()
+                    self.conn.write_frame(frame)
+                    await self.writer.drain()
+                    self.sending_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.fanout.remove(self.writer)
+
+
+class FanOut:
+    def __init__(self, name):
+        self.name = name
+        self.subscribers = {}
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def __contains__(self, writer):
+        return writer in self.subscribers
+
+    def add(self, conn, delta=False, filter=None):
+        sub = self.subscribers.get(conn.writer)
+        if sub is None:
+            sub = self.subscribers[conn.writer] = Subscriber(self, conn, delta, filter)
+        sub.delta = delta
+        if sub.filter is not filter:
+            # повторный REGISTER с другими условиями — следующий кадр полный
+            sub.filter = filter
+            sub.sent_version = sub.sent_update = None
+            sub.next_data_at = 0.0
+        return sub
+
+    def remove(self, writer):
+        sub = self.subscribers.pop(writer, None)
+        if sub is not None:
+            sub.close()
+        return sub is not None
+
+    def send(self, writer, frame):
+        """Служебный кадр подписчику в общем порядке с push-данными."""
+        sub = self.subscribers.get(writer)
+        if sub is None:
+            return False
+        return sub.offer_control(frame)
+
+    def publish(self, update):
+        """Рассылает уже закодированную версию данных (Update); не ждёт ни одного клиента."""
+        now = time.monotonic()
+        for writer, sub in list(self.subscribers.items()):
+            if sub.is_stalled(now):
+                self.evict(writer)
+                continue
+            sub.offer_data(update)
+
+    def evict(self, writer):
+        if self.remove(writer):
+            self.evicted += 1
+            print(f"{self.name}: Подписчик отключён за отставание")
+            try:
+                writer.close()
+            except Exception:
+                pass
@@ -0,0 +1,104 @@
+# Шлюз-агрегатор: одна подписка на Server1 и Server2 на всех клиентов.
+# Пояснение: шлюз держит по одному соединению к каждому серверу (REGISTER с дельтами),
+# собирает последние данные в общий снимок {"s1": {...}, "s2": {...}, "ts": ...} и раздаёт его
+# любому числу клиентов по одному соединению на клиента. Протокол для клиентов тот же, что у
+# серверов (MonitorServer): HELLO (JSON и zlib), POLL с версией, REGISTER/UNREGISTER, METRICS.
+# Каждое изменение любого сервера — один общий кадр DATA/DELTA, закодированный один раз.
+# Новый клиент сразу получает кэшированный снимок, не дожидаясь серверов. Если сервер
+# недоступен, его часть снимка равна null, а шлюз переподключается с растущей паузой.
+#
+# Пример: python gateway.py --port 8080 --s1 localhost:8081 --s2 localhost:8082
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE)
+sys.path.insert(0, BASE)
+
+from server_base import send_log, run_server, MonitorServer
+from monitor_client import MonitorClient, parse_hostport
+
+HOST = "0.0.0.0"
+PORT = 8080
+SERVER_NAME = "gateway"
+UPSTREAMS = {"s1": ("localhost", 8081), "s2": ("localhost", 8082)}
+
+UPSTREAM_FORMATS = ("bin", "json")
+UPSTREAM_COMPRESSION = ()
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 10.0
+
+
+class Gateway(MonitorServer):
+    NAME = "Gateway"
+    SERVER_NAME = SERVER_NAME
+    SCHEMA = None        # общий снимок передаётся в JSON
+    HISTORY_SIZE = 0     # история есть у самих серверов
+
+    def __init__(self, upstreams=UPSTREAMS):
+        self.FIELDS = tuple(upstreams)
+        super().__init__()
+        self.parts = {tag: None for tag in upstreams}
+        # одна подписка (REGISTER с дельтами) на каждый сервер
+        self.upstream = MonitorClient(upstreams, on_data=self.on_sample, on_status=self.on_upstream_status,
+                                      subscribe=True, auto_poll=False, formats=UPSTREAM_FORMATS,
+                                      compression=UPSTREAM_COMPRESSION,
+                                      reconnect_min=RECONNECT_MIN, reconnect_max=RECONNECT_MAX)
+
+    async def on_sample(self, sample):
+        await self.on_upstream(sample.tag, sample.payload)
+
+    def on_upstream_status(self, tag, status, detail):
+        host, port = self.upstream.links[tag].addr
+        if status == "connected":
+            print(f"Gateway: подключено к {tag} {host}:{port} ({detail['codec']})")
+            send_log(SERVER_NAME, "INFO", f"Upstream {tag} connected {host}:{port}")
+        elif status == "error":
+            print(f"Gateway: {tag} недоступен: {detail}")
+        elif status == "disconnected":
+            send_log(SERVER_NAME, "WARN", f"Upstream {tag} disconnected")
+            # клиенты должны узнать, что данные этого сервера больше не актуальны
+            asyncio.ensure_future(self.on_upstream(tag, None))
+
+    async def on_upstream(self, tag, payload):
+        self.parts[tag] = payload
+        data = dict(self.parts)
+        # ts снимка — время самой свежей из выборок серверов
+        stamps = [p["ts"] for p in self.parts.values() if p and "ts" in p]
+        data["ts"] = max(stamps) if stamps else round(time.time(), 3)
+        self._new_version(data)
+        await self.notify_subscribers(data)
+
+    async def start_monitor(self):
+        self.start_probes()
+        await self.upstream.run()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Шлюз-агрегатор Server1/Server2")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--s1", default="%s:%d" % UPSTREAMS["s1"], help="адрес Server1 (host:port)")
+    parser.add_argument("--s2", default="%s:%d" % UPSTREAMS["s2"], help="адрес Server2 (host:port)")
+    args = parser.parse_args()
+
+    try:
+        upstreams = {"s1": parse_hostport(args.s1, 8081, strict=True), "s2": parse_hostport(args.s2, 8082, strict=True)}
+    except ValueError as e:
+        parser.error(str(e))
+    g = Gateway(upstreams)
+    asyncio.create_task(g.start_monitor())
+    srv = await asyncio.start_server(g.handle_client, HOST, args.port)
+
+    print(f"Gateway запущен на {HOST}:{args.port}")
+    print("Ожидание подключений клиентов...")
+    send_log(SERVER_NAME, "INFO", f"Started on {HOST}:{args.port}")
+
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == "__main__":
+    run_server(main)
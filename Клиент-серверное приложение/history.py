@@ -0,0 +1,132 @@
+# История выборок сервера: кольцевой буфер фиксированного размера в типизированных массивах.
+# Пояснение: вместо списка словарей каждое поле хранится в своём array.array (тип берётся из
+# codec.SCHEMAS), метки времени — в array('d'). Память выделяется один раз: HISTORY_SIZE записей
+# на поле, например 86400 записей uptime/ширины/высоты/ts Server2 — около 2 МБ.
+# Запрос HISTORY делит диапазон [from, to) на корзины по bucket секунд и возвращает min/max/mean
+# по каждой. Границы корзин ищутся двоичным поиском, а агрегаты считаются встроенными min/max/sum
+# по срезам массивов (C-код, без цикла Python по записям); если установлен numpy — через reduceat.
+import time
+import array
+import bisect
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from codec import SCHEMAS
+
+HISTORY_SIZE = 86400          # записей в кольце (сутки при одной выборке в секунду)
+DEFAULT_RANGE = 3600.0        # диапазон запроса по умолчанию, с
+DEFAULT_BUCKET = 60.0
+MAX_BUCKETS = 2000            # больше корзин — bucket увеличивается
+
+
+class History:
+    def __init__(self, fields, schema=None, size=HISTORY_SIZE):
+        types = dict(SCHEMAS.get(schema, ()))
+        self.fields = tuple(fields)
+        self.size = max(1, int(size))
+        # array.array и struct используют одинаковые коды Q/I/d
+        self.ts = array.array("d", bytes(8 * self.size))
+        self.columns = {}
+        for f in self.fields:
+            code = types.get(f, "d")
+            self.columns[f] = array.array(code, bytes(array.array(code).itemsize * self.size))
+        self.head = 0      # индекс следующей записи
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ts, values):
+        i = self.head
+        if self.count and ts < self.ts[(i - 1) % self.size]:
+            # часы перевели назад — время в кольце должно оставаться неубывающим
+            ts = self.ts[(i - 1) % self.size]
+        self.ts[i] = ts
+        for f, v in zip(self.fields, values):
+            self.columns[f][i] = v
+        self.head = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def append_payload(self, payload):
+        self.append(payload.get("ts", time.time()), [payload.get(f, 0) for f in self.fields])
+
+    def memory_bytes(self):
+        return self.ts.itemsize * self.size + sum(c.itemsize * self.size for c in self.columns.values())
+
+    def _ordered(self, column):
+        # кольцо в хронологическом порядке: два memcpy, без цикла по записям
+        if self.count < self.size:
+            return column[:self.count]
+        return column[self.head:] + column[:self.head]
+
+    def query(self, start=None, end=None, bucket=DEFAULT_BUCKET, fields=None):
+        """Агрегаты по корзинам. Пустые корзины пропускаются (значение держится до следующей записи)."""
+        end = time.time() if end is None else float(end)
+        start = end - DEFAULT_RANGE if start is None else float(start)
+        bucket = DEFAULT_BUCKET if bucket is None else float(bucket)
+        if end <= start:
+            raise ValueError("пустой диапазон времени")
+        if not bucket > 0:
+            raise ValueError("bucket должен быть больше нуля")
+        if (end - start) / bucket > MAX_BUCKETS:
+            bucket = (end - start) / MAX_BUCKETS
+        if fields is None:
+            fields = list(self.fields)
+        elif not isinstance(fields, (list, tuple)):
+            raise ValueError("fields должен быть списком имён полей")
+        else:
+            unknown = [f for f in fields if not isinstance(f, str) or f not in self.columns]
+            if unknown:
+                raise ValueError(f"неизвестные поля: {unknown}")
+            fields = list(fields)
+
+        ts = self._ordered(self.ts)
+        lo = bisect.bisect_left(ts, start)
+        hi = bisect.bisect_left(ts, end)
+        result = {"from": start, "to": end, "bucket": bucket, "fields": fields,
+                  "ts": [], "count": [], "min": {f: [] for f in fields},
+                  "max": {f: [] for f in fields}, "mean": {f: [] for f in fields}}
+        if lo >= hi:
+            return result
+
+        if np is not None:
+            self._query_numpy(result, ts, lo, hi, start, bucket, fields)
+        else:
+            self._query_slices(result, ts, lo, hi, start, bucket, fields)
+        return result
+
+    def _query_slices(self, result, ts, lo, hi, start, bucket, fields):
+        columns = {f: self._ordered(self.columns[f])[lo:hi] for f in fields}
+        ts = ts[lo:hi]
+        i = 0
+        n = len(ts)
+        while i < n:
+            k = int((ts[i] - start) // bucket)
+            # max — защита от погрешности округления на самой границе корзины
+            j = max(bisect.bisect_left(ts, start + (k + 1) * bucket, i), i + 1)
+            result["ts"].append(round(start + k * bucket, 3))
+            result["count"].append(j - i)
+            for f in fields:
+                part = columns[f][i:j]
+                result["min"][f].append(min(part))
+                result["max"][f].append(max(part))
+                result["mean"][f].append(sum(part) / (j - i))
+            i = j
+
+    def _query_numpy(self, result, ts, lo, hi, start, bucket, fields):
+        t = np.frombuffer(ts, dtype=np.float64)[lo:hi]
+        keys = ((t - start) // bucket).astype(np.int64)
+        # начало каждой непустой корзины
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        counts = np.diff(np.r_[starts, len(t)])
+        result["ts"] = np.round(start + keys[starts] * bucket, 3).tolist()
+        result["count"] = counts.tolist()
+        for f in fields:
+            col = np.frombuffer(self._ordered(self.columns[f]), dtype=self.columns[f].typecode)[lo:hi]
+            result["min"][f] = np.minimum.reduceat(col, starts).tolist()
+            result["max"][f] = np.maximum.reduceat(col, starts).tolist()
+            result["mean"][f] = (np.add.reduceat(col.astype(np.float64), starts) / counts).tolist()
@@ -0,0 +1,280 @@
+# Безголовый генератор нагрузки для Server1/Server2 (без Tk).
+# Открывает N одновременных asyncio-соединений: часть подписывается на push (REGISTER),
+# остальные опрашивают сервер (POLL) с заданным интервалом. Считает скорость подключения,
+# задержку push от ts внутри выборки до получения (p50/p99/p999), время ответа на POLL,
+# память сервера на соединение и задержку цикла событий. Отчёт — JSON.
+#
+# Примеры:
+#   python loadgen.py --spawn server2 --connections 2000 --duration 20
+#   python loadgen.py --target localhost:8081 --connections 500 --subscribers 1.0 --report out.json
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import multiprocessing
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE)
+sys.path.insert(0, BASE)
+
+from codec import Connection, client_hello
+from metrics import LoopLagProbe
+
+LAG_PROBE_INTERVAL = 0.05
+
+
+def percentiles(values, points=(50, 99, 99.9)):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    out = {"count": len(values), "mean": round(sum(values) / len(values), 3), "max": round(values[-1], 3)}
+    for p in points:
+        i = min(len(values) - 1, int(len(values) * p / 100.0))
+        out[f"p{p:g}".replace(".", "")] = round(values[i], 3)
+    return out
+
+
+def rss_bytes(pid=None):
+    # /proc есть не везде; psutil — если установлен
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid or os.getpid()).memory_info().rss
+    except Exception:
+        return None
+
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except Exception:
+        return None
+
+
+def _serve(kind, port, ready, stop, results):
+    """Процесс с настоящим Server1/Server2.handle_client для нагрузочного теста."""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    if kind == "server1":
+        from server1 import Server1 as cls
+    else:
+        from server2 import Server2 as cls
+
+    async def main():
+        s = cls()
+        probe = LoopLagProbe(LAG_PROBE_INTERVAL)
+        asyncio.create_task(s.start_monitor())
+        asyncio.create_task(probe.run())
+        srv = await asyncio.start_server(s.handle_client, "127.0.0.1", port, backlog=4096)
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        srv.close()
+        results.put({"loop_lag_ms": percentiles(probe.samples), "versions": s.version,
+                     "evicted": s.fanout.evicted})
+        # тысячи открытых соединений не нужно корректно закрывать — просто завершаем процесс
+        results.close()
+        results.join_thread()
+        os._exit(0)
+
+    raise_fd_limit()
+    asyncio.run(main())
+
+
+class LoadGen:
+    def __init__(self, host, port, args):
+        self.host = host
+        self.port = port
+        self.args = args
+        self.connect_times = []
+        self.connect_failed = 0
+        self.connected = 0
+        self.push_latency = []
+        self.poll_rtt = []
+        self.frames = {}
+        self.errors = 0
+        self.stopping = False
+
+    def _count(self, t):
+        self.frames[t] = self.frames.get(t, 0) + 1
+
+    async def _open(self):
+        t0 = time.perf_counter()
+        try:
+            r, w = await asyncio.open_connection(self.host, self.port)
+            conn = Connection(r, w)
+            if self.args.format != "json" or self.args.compress:
+                await client_hello(conn, (self.args.format, "json"), ("zlib",) if self.args.compress else ())
+        except Exception:
+            self.connect_failed += 1
+            return None
+        self.connect_times.append((time.perf_counter() - t0) * 1e3)
+        self.connected += 1
+        return conn
+
+    async def subscriber(self, conn):
+        await conn.send({"type": "REGISTER", "delta": True})
+        while not self.stopping:
+            msg = await conn.recv()
+            if msg is None:
+                break
+            now = time.time()
+            t = msg.get("type")
+            self._count(t)
+            ts = None
+            if t == "DATA":
+                ts = msg.get("payload", {}).get("ts")
+            elif t == "DELTA":
+                ts = msg.get("changes", {}).get("ts")
+            if ts is not None:
+                self.push_latency.append((now - ts) * 1e3)
+
+    async def poller(self, conn):
+        version = 0
+        interval = self.args.poll_interval
+        await asyncio.sleep(random.random() * interval)
+        while not self.stopping:
+            t0 = time.perf_counter()
+            await conn.send({"type": "POLL", "version": version, "delta": True})
+            msg = await conn.recv()
+            if msg is None:
+                break
+            self.poll_rtt.append((time.perf_counter() - t0) * 1e3)
+            self._count(msg.get("type"))
+            if msg.get("type") == "DATA":
+                version = msg.get("version", 0)
+            elif msg.get("type") == "DELTA":
+                version = msg.get("version", 0) if msg.get("base") == version else 0
+            await asyncio.sleep(interval)
+
+    async def _client(self, role):
+        conn = await self._open()
+        if conn is None:
+            return
+        try:
+            await (self.subscriber(conn) if role == "sub" else self.poller(conn))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            self.errors += 1
+        finally:
+            conn.writer.close()
+
+    async def run(self, server_pid=None):
+        a = self.args
+        probe = LoopLagProbe(LAG_PROBE_INTERVAL)
+        probe_task = asyncio.create_task(probe.run())
+        rss_before = rss_bytes(server_pid) if server_pid else None
+
+        tasks = []
+        t0 = time.perf_counter()
+        n_sub = int(round(a.connections * a.subscribers))
+        roles = ["sub"] * n_sub + ["poll"] * (a.connections - n_sub)
+        random.shuffle(roles)
+        for i, role in enumerate(roles):
+            tasks.append(asyncio.create_task(self._client(role)))
+            if a.connect_rate > 0:
+                # равномерный темп подключения
+                delay = t0 + (i + 1) / a.connect_rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        while self.connected + self.connect_failed < len(roles) and time.perf_counter() - t0 < a.duration:
+            await asyncio.sleep(0.01)
+        connect_elapsed = time.perf_counter() - t0
+        rss_connected = rss_bytes(server_pid) if server_pid else None
+
+        # Задержку push меряем только после того, как все подключились:
+        # кадры, полученные сразу после REGISTER, — это кэш сервера, а не свежий push
+        self.push_latency.clear()
+        self.poll_rtt.clear()
+        await asyncio.sleep(a.duration)
+        self.stopping = True
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        probe_task.cancel()
+
+        per_conn = None
+        if rss_before and rss_connected and self.connected:
+            per_conn = round((rss_connected - rss_before) / self.connected)
+        return {
+            "target": f"{self.host}:{self.port}",
+            "config": {"connections": a.connections, "subscribers": a.subscribers, "poll_interval": a.poll_interval,
+                       "connect_rate": a.connect_rate, "duration": a.duration, "format": a.format,
+                       "compress": a.compress},
+            "connect": {"ok": self.connected, "failed": self.connect_failed,
+                        "rate_per_s": round(self.connected / connect_elapsed, 1) if connect_elapsed else None,
+                        "time_ms": percentiles(self.connect_times)},
+            "push_latency_ms": percentiles(self.push_latency),
+            "poll_rtt_ms": percentiles(self.poll_rtt),
+            "frames": self.frames,
+            "errors": self.errors,
+            "memory": {"server_rss_before": rss_before, "server_rss_connected": rss_connected,
+                       "bytes_per_connection": per_conn},
+            "loop_lag_ms": {"loadgen": percentiles(probe.samples)},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Server1/Server2")
+    parser.add_argument("--target", default="localhost:8082", help="host:port работающего сервера")
+    parser.add_argument("--spawn", choices=("server1", "server2"),
+                        help="запустить сервер в отдельном процессе на localhost (порт из --target)")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--subscribers", type=float, default=0.5, help="доля подписчиков REGISTER (0..1)")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--connect-rate", type=float, default=1000, help="подключений в секунду (0 — сразу все)")
+    parser.add_argument("--duration", type=float, default=15, help="длительность замера после подключения, с")
+    parser.add_argument("--format", choices=("json", "bin"), default="json")
+    parser.add_argument("--compress", action="store_true")
+    parser.add_argument("--report", help="файл для JSON-отчёта (по умолчанию — stdout)")
+    args = parser.parse_args()
+
+    host, _, port = args.target.rpartition(":")
+    host, port = host or "localhost", int(port)
+    raise_fd_limit()
+
+    proc = stop = results = None
+    if args.spawn:
+        ready, stop, results = multiprocessing.Event(), multiprocessing.Event(), multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_serve, args=(args.spawn, port, ready, stop, results), daemon=True)
+        proc.start()
+        if not ready.wait(10):
+            sys.exit("Сервер не запустился")
+        host = "127.0.0.1"
+
+    report = asyncio.run(LoadGen(host, port, args).run(proc.pid if proc else None))
+    if proc:
+        stop.set()
+        try:
+            server = results.get(timeout=5)
+            report["loop_lag_ms"]["server"] = server.pop("loop_lag_ms")
+            report["server"] = server
+        except Exception:
+            pass
+        proc.join(5)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Отчёт записан в {args.report}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
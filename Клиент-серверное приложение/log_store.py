@@ -0,0 +1,572 @@
+# Хранилище логов LogServer: по одному долгоживущему буферизованному файлу на отправителя.
+# Пояснение: файл logs/store/{sender}.ndjson открывается один раз и дописывается из разных потоков
+# под блокировкой этого отправителя; сброс буфера на диск и fsync — по настраиваемой политике.
+# Каталог logs/store/ принадлежит только хранилищу: файлы вывода процессов (logs/*.log из
+# run_all.sh) хранилище не читает и не трогает.
+# Рядом ведётся разреженный индекс logs/store/{sender}.idx: файл делится на блоки примерно по
+# INDEX_BLOCK байт, и для каждого завершённого блока записывается (начало, конец, min ts, max ts).
+# Индекс дописывается по мере приёма записей, а запрос (query) читает через mmap только
+# блоки, пересекающиеся с диапазоном времени, плюс ещё не проиндексированный хвост.
+# Активный файл отправителя закрывается в сегмент по размеру (SEGMENT_MAX_BYTES) или возрасту
+# (SEGMENT_MAX_AGE): он переименовывается в logs/store/segments/{sender}-{N}.ndjson, а фоновый поток
+# сжимает его в .gz. Манифест logs/store/segments/{sender}.json хранит диапазон ts каждого сегмента,
+# поэтому запрос пропускает сегменты вне диапазона и распаковывает только нужные.
+# Хранение ограничено суммарным размером сегментов (RETENTION_BYTES) и их возрастом (RETENTION_AGE).
+import os
+import re
+import gzip
+import json
+import mmap
+import time
+import heapq
+import shutil
+import struct
+import threading
+import collections
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "store")
+LOG_SUFFIX = ".ndjson"
+
+FLUSH_POLICY = "interval"   # always — после каждой записи | interval — раз в FLUSH_INTERVAL | none — только при закрытии
+FLUSH_INTERVAL = 1.0
+FSYNC = False               # вызывать os.fsync после сброса буфера
+WRITE_BUFFER = 64 * 1024
+INDEX_BLOCK = 64 * 1024     # байт лога на одну запись индекса
+QUERY_LIMIT = 100000        # максимум записей в ответе на запрос
+# Файл отправителя идёт в порядке приёма, ts в нём почти монотонны. Запрос упорядочивает записи
+# буфером на QUERY_REORDER записей на отправителя: запись, опоздавшая не больше чем на столько
+# записей того же отправителя, встаёт на место по ts; опоздавшая сильнее выйдет позже соседей.
+QUERY_REORDER = 10000
+
+# Запись индекса: смещение начала и конца блока, минимальная и максимальная метка времени
+INDEX_ENTRY = struct.Struct("!QQdd")
+
+# Сегменты и хранение (0 — ограничение выключено)
+SEGMENT_DIR = "segments"
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_MAX_AGE = 24 * 3600
+RETENTION_BYTES = 1024 * 1024 * 1024
+RETENTION_AGE = 30 * 24 * 3600
+COMPRESS_LEVEL = 6
+MAINTENANCE_INTERVAL = 5.0   # как часто проверять возраст активных файлов и хранение, с
+
+_SAFE_SENDER = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def safe_sender(sender):
+    # имя отправителя становится именем файла — убираем разделители путей и прочее
+    name = _SAFE_SENDER.sub("_", str(sender or "unknown")).strip(".")
+    return name or "unknown"
+
+
+def _record_ts(line):
+    try:
+        return float(json.loads(line).get("ts", 0))
+    except Exception:
+        return 0.0
+
+
+def _match(lines, levels, start, end, contains):
+    """Фильтр строк NDJSON: пары (ts, строка) записей, подходящих под условия запроса."""
+    # быстрая проверка по сырым байтам до разбора JSON; старые записи могли быть сохранены
+    # с \uXXXX вместо UTF-8, поэтому ищем оба варианта экранирования
+    needles = None
+    if contains:
+        needles = {json.dumps(contains, ensure_ascii=a)[1:-1].encode("utf-8") for a in (False, True)}
+    for line in lines:
+        if needles is not None and not any(n in line for n in needles):
+            continue
+        try:
+            rec = json.loads(line)
+            ts = float(rec.get("ts", 0))
+        except Exception:
+            continue
+        if ts < start or ts > end:
+            continue
+        if levels is not None and str(rec.get("level", "")).upper() not in levels:
+            continue
+        if contains and contains not in str(rec.get("message", "")):
+            continue
+        yield ts, line
+
+
+def _reorder(items, window=QUERY_REORDER):
+    """Пары (ts, строка) почти по возрастанию ts -> по возрастанию; в памяти не больше window пар.
+    При равных ts сохраняется порядок приёма."""
+    heap = []
+    for n, (ts, line) in enumerate(items):
+        if len(heap) < window:
+            heapq.heappush(heap, (ts, n, line))
+            continue
+        ts, _, line = heapq.heappushpop(heap, (ts, n, line))
+        yield ts, line
+    while heap:
+        ts, _, line = heapq.heappop(heap)
+        yield ts, line
+
+
+def _mmap_lines(f, size, ranges):
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+        for r_start, r_end in ranges:
+            pos = r_start
+            while pos < r_end:
+                nl = mm.find(b"\n", pos, r_end)
+                if nl < 0:
+                    nl = r_end
+                yield mm[pos:nl]
+                pos = nl + 1
+
+
+def _segment_lines(path):
+    # сегмент могли сжать или удалить по хранению, пока запрос до него дошёл
+    for p in (path, path + ".gz") if not path.endswith(".gz") else (path,):
+        try:
+            f = gzip.open(p, "rb") if p.endswith(".gz") else open(p, "rb")
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                yield line.rstrip(b"\n")
+        return
+
+
+class _SenderLog:
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + ".idx"
+        # readonly — только для запроса: индекс читается, но ни лог, ни индекс не изменяются
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self.blocks = []          # завершённые блоки: (начало, конец, min ts, max ts)
+        self.offset = 0           # размер файла вместе с ещё не сброшенным буфером
+        self.block_start = 0
+        self.block_min = None
+        self.block_max = None
+        self.started = None       # когда в файл попала первая запись (для ротации по возрасту)
+        pending = self._load_index()
+        if self.offset:
+            # файл остался с прошлого запуска — возраст считаем по самой старой записи
+            self.started = min(self.time_range()[0], time.time())
+        if self.readonly:
+            self.f = self.idx = None
+            return
+        self.f = open(self.path, "ab", buffering=WRITE_BUFFER)
+        self.idx = open(self.index_path, "ab")
+        if pending:
+            self.idx.write(pending)
+            self.idx.flush()
+        self.dirty = False
+
+    def close(self):
+        for f in (self.f, self.idx):
+            if f is None:
+                continue
+            try:
+                f.close()
+            except Exception:
+                pass
+
+    def time_range(self):
+        """(min ts, max ts) всех записей активного файла или None, если он пуст."""
+        lows = [b[2] for b in self.blocks]
+        highs = [b[3] for b in self.blocks]
+        if self.block_min is not None:
+            lows.append(self.block_min)
+            highs.append(self.block_max)
+        return (min(lows), max(highs)) if lows else None
+
+    def _load_index(self):
+        """Читает .idx и доиндексирует хвост лога (старые файлы без индекса, сбой до сброса индекса)."""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            raw = b""
+        end = 0
+        for entry in INDEX_ENTRY.iter_unpack(raw[:len(raw) - len(raw) % INDEX_ENTRY.size]):
+            if entry[0] != end or entry[1] > size:
+                break
+            self.blocks.append(entry)
+            end = entry[1]
+        if len(self.blocks) * INDEX_ENTRY.size != len(raw) and not self.readonly:
+            # индекс повреждён или опережает лог — оставляем согласованную часть
+            with open(self.index_path, "wb") as f:
+                f.write(b"".join(INDEX_ENTRY.pack(*b) for b in self.blocks))
+        self.offset = self.block_start = end
+        pending = []
+        if size > end:
+            with open(self.path, "rb") as f:
+                f.seek(end)
+                for line in f:
+                    entry = self.note(_record_ts(line), len(line))
+                    if entry:
+                        pending.append(entry)
+        return b"".join(pending)
+
+    def note(self, ts, nbytes):
+        """Учитывает дописанную строку; возвращает упакованную запись индекса, если блок завершён."""
+        if self.started is None:
+            self.started = time.time()
+        self.offset += nbytes
+        if self.block_min is None or ts < self.block_min:
+            self.block_min = ts
+        if self.block_max is None or ts > self.block_max:
+            self.block_max = ts
+        if self.offset - self.block_start < INDEX_BLOCK:
+            return None
+        block = (self.block_start, self.offset, self.block_min, self.block_max)
+        self.blocks.append(block)
+        self.block_start = self.offset
+        self.block_min = self.block_max = None
+        return INDEX_ENTRY.pack(*block)
+
+    def ranges(self, start, end):
+        """Участки файла, где могут быть записи с ts в [start, end]; вызывать под lock."""
+        out = []
+        for b_start, b_end, lo, hi in self.blocks:
+            if hi < start or lo > end:
+                continue
+            if out and out[-1][1] == b_start:
+                out[-1] = (out[-1][0], b_end)
+            else:
+                out.append((b_start, b_end))
+        if self.offset > self.block_start:
+            if out and out[-1][1] == self.block_start:
+                out[-1] = (out[-1][0], self.offset)
+            else:
+                out.append((self.block_start, self.offset))
+        return out
+
+
+class LogStore:
+    def __init__(self, log_dir=LOG_DIR, flush_policy=FLUSH_POLICY, flush_interval=FLUSH_INTERVAL, fsync=FSYNC,
+                 segment_bytes=SEGMENT_MAX_BYTES, segment_age=SEGMENT_MAX_AGE,
+                 retention_bytes=RETENTION_BYTES, retention_age=RETENTION_AGE):
+        if flush_policy not in ("always", "interval", "none"):
+            raise ValueError(f"Неизвестная политика сброса: {flush_policy}")
+        self.log_dir = log_dir
+        self.segment_dir = os.path.join(log_dir, SEGMENT_DIR)
+        self.flush_policy = flush_policy
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.retention_bytes = retention_bytes
+        self.retention_age = retention_age
+        self._senders = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+        self._closed = threading.Event()
+        # манифесты сегментов: sender -> {"next_seq": N, "segments": [...]}
+        self._manifests = {}
+        self._manifest_lock = threading.Lock()
+        self._compress_queue = collections.deque()
+        self._maintenance = threading.Condition()
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._load_manifests()
+        if flush_policy == "interval":
+            threading.Thread(target=self._flusher, name="log-flusher", daemon=True).start()
+        self._maintainer = threading.Thread(target=self._maintain, name="log-segments", daemon=True)
+        self._maintainer.start()
+
+    def _get(self, sender):
+        log = self._senders.get(sender)
+        if log is None:
+            with self._lock:
+                log = self._senders.get(sender)
+                if log is None:
+                    log = _SenderLog(self._log_path(sender))
+                    self._senders[sender] = log
+        return log
+
+    def _log_path(self, sender):
+        return os.path.join(self.log_dir, sender + LOG_SUFFIX)
+
+    def append(self, record):
+        """Дописывает одну запись (dict). Возвращает нормализованное имя отправителя."""
+        sender = safe_sender(record.get("sender", "unknown"))
+        self.append_many(sender, [record])
+        return sender
+
+    def append_many(self, sender, records):
+        """Дописывает пачку записей одного отправителя за одну блокировку."""
+        now = time.time()
+        lines = []
+        for r in records:
+            # метка времени нужна индексу; запись без ts получает время приёма
+            if not isinstance(r.get("ts"), (int, float)):
+                r["ts"] = now
+            lines.append((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._write(sender, [r["ts"] for r in records], lines)
+
+    def append_raw(self, sender, items):
+        """Пачка (запись, исходная JSON-строка) одного отправителя (TCP-поток): строка с числовым
+        ts пишется как пришла, без повторной сериализации."""
+        now = time.time()
+        stamps = []
+        lines = []
+        for r, raw in items:
+            ts = r.get("ts")
+            if isinstance(ts, (int, float)):
+                lines.append(raw.strip() + b"\n")
+            else:
+                ts = r["ts"] = now
+                lines.append((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8"))
+            stamps.append(ts)
+        self._write(sender, stamps, lines)
+
+    def _write(self, sender, stamps, lines):
+        data = b"".join(lines)
+        log = self._get(safe_sender(sender))
+        with log.lock:
+            log.f.write(data)
+            for ts, line in zip(stamps, lines):
+                entry = log.note(ts, len(line))
+                if entry:
+                    log.idx.write(entry)
+            log.dirty = True
+            if self.flush_policy == "always":
+                self._flush_one(log)
+            if self.segment_bytes and log.offset >= self.segment_bytes:
+                self._rotate(safe_sender(sender), log)
+        with self._stats_lock:
+            self.records += len(lines)
+            self.bytes += len(data)
+
+    def _flush_one(self, log):
+        log.f.flush()
+        if self.fsync:
+            os.fsync(log.f.fileno())
+        # индекс сбрасывается после данных: на диске он не опережает лог
+        log.idx.flush()
+        log.dirty = False
+
+    def flush(self):
+        for log in list(self._senders.values()):
+            with log.lock:
+                if log.dirty:
+                    try:
+                        self._flush_one(log)
+                    except Exception as e:
+                        print(f"LogServer: Ошибка сброса {log.path}: {e}")
+
+    def _flusher(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    # --- сегменты ---
+
+    def _manifest_path(self, sender):
+        return os.path.join(self.segment_dir, f"{sender}.json")
+
+    def _load_manifests(self):
+        for name in os.listdir(self.segment_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.segment_dir, name), encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except Exception as e:
+                print(f"LogServer: Не удалось прочитать манифест {name}: {e}")
+                continue
+            self._manifests[name[:-5]] = manifest
+            for seg in manifest["segments"]:
+                if not seg["file"].endswith(".gz"):
+                    # сжатие не успело завершиться до остановки
+                    self._compress_queue.append((name[:-5], seg["file"]))
+
+    def _save_manifest(self, sender):
+        """Атомарная запись манифеста; вызывать под _manifest_lock."""
+        path = self._manifest_path(sender)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._manifests[sender], f, ensure_ascii=False, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def _rotate(self, sender, log):
+        """Закрывает активный файл отправителя в сегмент; вызывать под log.lock."""
+        time_range = log.time_range()
+        if time_range is None:
+            return
+        self._flush_one(log)
+        log.close()
+        with self._manifest_lock:
+            manifest = self._manifests.setdefault(sender, {"next_seq": 1, "segments": []})
+            name = f"{sender}-{manifest['next_seq']:06d}{LOG_SUFFIX}"
+            try:
+                os.replace(log.path, os.path.join(self.segment_dir, name))
+            except OSError as e:
+                # например, файл открыт другим процессом (Windows) — попробуем в следующий раз
+                print(f"LogServer: Не удалось закрыть сегмент {log.path}: {e}")
+            else:
+                manifest["next_seq"] += 1
+                manifest["segments"].append({"file": name, "min_ts": time_range[0], "max_ts": time_range[1],
+                                             "bytes": log.offset, "size": log.offset, "sealed": time.time()})
+                self._save_manifest(sender)
+                try:
+                    os.remove(log.index_path)
+                except OSError:
+                    pass
+                with self._maintenance:
+                    self._compress_queue.append((sender, name))
+                    self._maintenance.notify()
+        log._open()
+
+    def _compress(self, sender, name):
+        src = os.path.join(self.segment_dir, name)
+        dst = src + ".gz"
+        try:
+            with open(src, "rb") as fin, gzip.open(dst + ".tmp", "wb", compresslevel=COMPRESS_LEVEL) as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+            os.replace(dst + ".tmp", dst)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"LogServer: Ошибка сжатия сегмента {name}: {e}")
+            return
+        with self._manifest_lock:
+            manifest = self._manifests.get(sender, {"segments": []})
+            for seg in manifest["segments"]:
+                if seg["file"] == name:
+                    seg["file"] = name + ".gz"
+                    seg["size"] = os.path.getsize(dst)
+                    self._save_manifest(sender)
+                    break
+        try:
+            os.remove(src)
+        except OSError:
+            pass
+
+    def _enforce_retention(self):
+        now = time.time()
+        with self._manifest_lock:
+            # все сегменты всех отправителей, от старых к новым
+            segments = sorted(((seg["max_ts"], sender, seg) for sender, m in self._manifests.items()
+                               for seg in m["segments"]), key=lambda item: item[0])
+            total = sum(seg["size"] for _, _, seg in segments)
+            changed = set()
+            for max_ts, sender, seg in segments:
+                too_old = self.retention_age and max_ts < now - self.retention_age
+                too_big = self.retention_bytes and total > self.retention_bytes
+                if not (too_old or too_big):
+                    break
+                try:
+                    os.remove(os.path.join(self.segment_dir, seg["file"]))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"LogServer: Не удалось удалить сегмент {seg['file']}: {e}")
+                    continue
+                self._manifests[sender]["segments"].remove(seg)
+                total -= seg["size"]
+                changed.add(sender)
+            for sender in changed:
+                self._save_manifest(sender)
+
+    def _rotate_old(self):
+        now = time.time()
+        for sender, log in list(self._senders.items()):
+            with log.lock:
+                if log.started is not None and now - log.started >= self.segment_age:
+                    self._rotate(sender, log)
+
+    def _maintain(self):
+        while True:
+            with self._maintenance:
+                if not self._compress_queue:
+                    self._maintenance.wait(MAINTENANCE_INTERVAL)
+                job = self._compress_queue.popleft() if self._compress_queue else None
+            if self._closed.is_set():
+                break
+            if job is not None:
+                self._compress(*job)
+            try:
+                if self.segment_age:
+                    self._rotate_old()
+                if self.retention_bytes or self.retention_age:
+                    self._enforce_retention()
+            except Exception as e:
+                print(f"LogServer: Ошибка обслуживания сегментов: {e}")
+
+    def segments(self, sender=None):
+        with self._manifest_lock:
+            return {s: [dict(seg) for seg in m["segments"]] for s, m in self._manifests.items()
+                    if sender is None or s == sender}
+
+    # --- запросы ---
+
+    def senders(self):
+        names = set(self._senders)
+        try:
+            names.update(n[:-len(LOG_SUFFIX)] for n in os.listdir(self.log_dir) if n.endswith(LOG_SUFFIX))
+        except OSError:
+            pass
+        with self._manifest_lock:
+            names.update(self._manifests)
+        return sorted(names)
+
+    def query(self, senders=None, levels=None, start=None, end=None, contains=None, limit=QUERY_LIMIT):
+        """Строки NDJSON (bytes без перевода строки), отобранные по фильтрам и упорядоченные по ts."""
+        start = float("-inf") if start is None else float(start)
+        end = float("inf") if end is None else float(end)
+        levels = {lv.upper() for lv in levels} if levels else None
+        names = [safe_sender(s) for s in senders] if senders else self.senders()
+        # файл отправителя идёт в порядке приёма, а не по ts (часы клиента могут прыгать):
+        # каждый поток упорядочивается ограниченным буфером, слияние и limit остаются ленивыми
+        scans = [_reorder(self._scan(name, levels, start, end, contains)) for name in names]
+        for n, (_, line) in enumerate(heapq.merge(*scans, key=lambda item: item[0])):
+            if limit is not None and n >= limit:
+                break
+            yield line
+
+    def _scan(self, sender, levels, start, end, contains):
+        # сначала закрытые сегменты, чей диапазон ts пересекается с запросом
+        with self._manifest_lock:
+            manifest = self._manifests.get(sender, {"segments": []})
+            files = [seg["file"] for seg in manifest["segments"]
+                     if not (seg["max_ts"] < start or seg["min_ts"] > end)]
+        for name in files:
+            yield from _match(_segment_lines(os.path.join(self.segment_dir, name)), levels, start, end, contains)
+
+        log = self._senders.get(sender)
+        if log is not None:
+            with log.lock:
+                if log.dirty:
+                    self._flush_one(log)
+                ranges = log.ranges(start, end)
+                size = log.offset
+                # файл открывается под блокировкой: переименование в сегмент не помешает чтению
+                f = open(log.path, "rb") if ranges and size else None
+        else:
+            # в этом запуске отправитель ещё не писал — файл только читается, без открытия на запись
+            path = self._log_path(sender)
+            try:
+                view = _SenderLog(path, readonly=True)
+                ranges = view.ranges(start, end)
+                size = view.offset
+                f = open(path, "rb") if ranges and size else None
+            except FileNotFoundError:
+                return
+        if f is None:
+            return
+        with f:
+            yield from _match(_mmap_lines(f, size, ranges), levels, start, end, contains)
+
+    def counters(self):
+        with self._stats_lock:
+            return self.records, self.bytes
+
+    def close(self):
+        self._closed.set()
+        with self._maintenance:
+            self._maintenance.notify_all()
+        self.flush()
+        for log in list(self._senders.values()):
+            with log.lock:
+                log.close()
+        self._senders.clear()
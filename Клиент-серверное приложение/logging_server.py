@@ -1,68 +1,472 @@
+# Централизованный LogServer.
+# Приём записей — HTTP (POST /log, POST /log/batch) и долгоживущее TCP-соединение на STREAM_PORT:
+# клиент пишет записи JSON по строке (NDJSON) без ожидания ответов, а сервер время от времени
+# присылает кумулятивное подтверждение {"ack": N, "rejected": M} — N строк этого соединения
+# обработаны (M из них отброшены как некорректные). Если сервер не успевает, TCP сам
+# притормаживает отправителя. Записи разбираются и пишутся в хранилище пачками, по мере чтения.
+# GET /stats отвечает, сколько записей каждого отправителя и уровня пришло за последние N секунд:
+# счётчики ведутся в памяти при приёме (LogStats), диск не читается.
 import os
 import sys
 import json
+import math
 import time
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse
+import socket
+import signal
+import argparse
+import threading
+import collections
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(BASE)
 sys.path.insert(0, BASE)
 
+import log_store
+from log_store import LogStore, safe_sender
+
 PORT = 8888
-LOG_DIR = os.path.join(BASE, "logs")
+STREAM_PORT = 8889      # TCP-приём потока записей (0 — выключен)
+LOG_DIR = os.path.join(BASE, "logs", "store")   # только файлы хранилища (см. log_store.py)
 os.makedirs(LOG_DIR, exist_ok=True)
 
+ECHO = True             # печатать каждую запись в консоль LogServer
+STATS_INTERVAL = 10     # период вывода скорости приёма, с (0 — не выводить)
+MAX_BODY = 16 * 1024 * 1024
+STREAM_CHUNK = 64 * 1024   # размер порции chunked-ответа /query
+STREAM_RECV = 256 * 1024   # байт за одно чтение TCP-потока записей
+ACK_RECORDS = 5000         # подтверждение не реже, чем через столько строк...
+ACK_INTERVAL = 0.2         # ...или секунд; и сразу, как только прочитано всё, что прислал клиент
+
+STATS_BUCKET = 10.0        # ширина корзины счётчиков /stats, с
+STATS_BUCKETS = 360        # корзин в кольце: окно до STATS_BUCKET * STATS_BUCKETS = 1 ч
+STATS_WINDOW = 300.0       # окно /stats по умолчанию, с
+STATS_MAX_KEYS = 1000      # пар (отправитель, уровень); остальные считаются под отправителем "_other"
+
+
+def parse_records(body):
+    # Пакет: JSON-массив объектов или NDJSON (по объекту в строке)
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        records = json.loads(text)
+        if not isinstance(records, list):
+            raise ValueError("ожидался массив записей")
+    else:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for r in records:
+        if not isinstance(r, dict):
+            raise ValueError("запись должна быть JSON-объектом")
+    return records
+
+
+def parse_query(qs):
+    """Параметры GET /query -> аргументы LogStore.query.
+
+    sender, level — через запятую; from/to — unix-время; since — «за последние N секунд»;
+    q — подстрока сообщения; limit — максимум записей.
+    """
+    params = {k: v[-1] for k, v in parse_qs(qs).items()}
+
+    def split(name):
+        value = params.get(name)
+        return [x for x in value.split(",") if x] if value else None
+
+    start = float(params["from"]) if "from" in params else None
+    if "since" in params:
+        start = time.time() - float(params["since"])
+    limit = min(int(params.get("limit", log_store.QUERY_LIMIT)), log_store.QUERY_LIMIT)
+    return {"senders": split("sender"), "levels": split("level"), "start": start,
+            "end": float(params["to"]) if "to" in params else None,
+            "contains": params.get("q") or None, "limit": limit}
+
+
+def print_records(records):
+    for data in records:
+        # ВЫВОД В КОНСОЛЬ ЛОГСЕРВЕРА
+        print(f"LogServer: [{data.get('sender', 'unknown')}] {data.get('level', 'INFO')} - {data.get('message', '')}")
+
+
+class IngestMeter:
+    """Считает скорость приёма (записей/с и байт/с) по счётчикам хранилища."""
+
+    def __init__(self, store):
+        self.store = store
+        self.started = time.time()
+        self._last = (time.monotonic(), 0, 0)
+        self.rates = (0.0, 0.0)
+
+    def sample(self):
+        now = time.monotonic()
+        records, nbytes = self.store.counters()
+        t0, r0, b0 = self._last
+        dt = max(now - t0, 1e-9)
+        self.rates = ((records - r0) / dt, (nbytes - b0) / dt)
+        self._last = (now, records, nbytes)
+        return self.rates
+
+    def snapshot(self):
+        records, nbytes = self.store.counters()
+        return {"records": records, "bytes": nbytes, "records_per_s": round(self.rates[0], 1),
+                "bytes_per_s": round(self.rates[1], 1), "uptime": round(time.time() - self.started, 1)}
+
+    def report_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            rps, bps = self.sample()
+            if rps:
+                print(f"LogServer: приём {rps:,.0f} записей/с, {bps / 1024:,.1f} КБ/с".replace(",", " "))
+
+
+class LogStats:
+    """Скользящие счётчики записей по (отправитель, уровень) в кольце корзин фиксированного размера.
+
+    Корзина — STATS_BUCKET секунд по ts записи. Номер корзины (эпоха) хранится один на слот
+    кольца для всех ключей: при переходе слота к новой эпохе он обнуляется у всех ключей разом.
+    Запрос за окно суммирует только нужные слоты — O(ключей * корзин окна).
+    """
+
+    def __init__(self, bucket=STATS_BUCKET, buckets=STATS_BUCKETS, max_keys=STATS_MAX_KEYS):
+        self.bucket = float(bucket)
+        self.size = int(buckets)
+        self.max_keys = max_keys
+        self.epochs = [-1] * self.size
+        self.counts = {}     # (sender, level) -> [счётчик на слот]
+        self.totals = {}     # (sender, level) -> всего с запуска
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self._names = {}     # исходное имя отправителя -> имя файла (safe_sender)
+
+    def add(self, records):
+        now = time.time()
+        local = collections.Counter()
+        names = self._names
+        for r in records:
+            sender = r.get("sender", "unknown")
+            name = names.get(sender) if isinstance(sender, str) else None
+            if name is None:
+                name = safe_sender(sender)
+                if isinstance(sender, str) and len(names) < self.max_keys:
+                    names[sender] = name
+            ts = r.get("ts")
+            # запись без ts или «из будущего» (расхождение часов) считается по времени приёма
+            if not isinstance(ts, (int, float)) or ts > now:
+                ts = now
+            local[name, str(r.get("level", "INFO")).upper(), int(ts // self.bucket)] += 1
+        with self.lock:
+            for (sender, level, epoch), n in local.items():
+                self._add(sender, level, epoch, n)
+
+    def _add(self, sender, level, epoch, n):
+        key = (sender, level)
+        counts = self.counts.get(key)
+        if counts is None:
+            if len(self.counts) >= self.max_keys:
+                key = ("_other", level)
+                counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * self.size
+        self.totals[key] = self.totals.get(key, 0) + n
+        slot = epoch % self.size
+        current = self.epochs[slot]
+        if current != epoch:
+            if current > epoch:
+                # старше всего кольца — только в итог с запуска
+                return
+            for c in self.counts.values():
+                c[slot] = 0
+            self.epochs[slot] = epoch
+        counts[slot] += n
+
+    def query(self, window=STATS_WINDOW, senders=None, levels=None):
+        now = time.time()
+        window = min(max(float(window), self.bucket), self.bucket * self.size)
+        last = int(now // self.bucket)
+        first = last - math.ceil(window / self.bucket) + 1
+        # фактически покрытый интервал: от начала первой корзины до текущего момента
+        span = max(now - first * self.bucket, 1e-9)
+        levels = {l.upper() for l in levels} if levels else None
+        result = {"window": window, "bucket": self.bucket, "from": round(first * self.bucket, 3),
+                  "to": round(now, 3), "total": 0, "rate": 0.0, "senders": {}}
+        with self.lock:
+            slots = [e % self.size for e in range(first, last + 1) if self.epochs[e % self.size] == e]
+            for (sender, level), counts in self.counts.items():
+                if (senders and sender not in senders) or (levels and level not in levels):
+                    continue
+                n = sum(counts[s] for s in slots)
+                entry = result["senders"].setdefault(sender, {"total": 0, "rate": 0.0, "levels": {}})
+                entry["levels"][level] = {"count": n, "rate": round(n / span, 3),
+                                          "since_start": self.totals.get((sender, level), 0)}
+                entry["total"] += n
+                result["total"] += n
+        for entry in result["senders"].values():
+            entry["rate"] = round(entry["total"] / span, 3)
+        result["rate"] = round(result["total"] / span, 3)
+        return result
+
+
+def parse_stats_query(qs):
+    """Параметры GET /stats: window — окно, с; sender, level — через запятую."""
+    params = {k: v[-1] for k, v in parse_qs(qs).items()}
+
+    def split(name):
+        value = params.get(name)
+        return {x for x in value.split(",") if x} if value else None
+
+    window = float(params.get("window", STATS_WINDOW))
+    if not window > 0:
+        raise ValueError("window должен быть положительным числом секунд")
+    return {"window": window, "senders": split("sender"), "levels": split("level")}
+
+
 class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 — соединения keep-alive, отправитель логов шлёт пачки по одному соединению
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело ответа уходят отдельными write — без этого Nagle + delayed ACK дают ~40 мс на запрос
+    disable_nagle_algorithm = True
+    store = None
+    meter = None
+    stats = None
+    echo = ECHO
+
+    def _reply(self, code, body=b"", content_type="text/plain; charset=utf-8"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _stream(self, lines):
+        # NDJSON по мере чтения файлов, chunked — длина ответа заранее неизвестна
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        buf = []
+        size = 0
+        try:
+            for line in lines:
+                buf.append(line)
+                size += len(line) + 1
+                if size >= STREAM_CHUNK:
+                    self._chunk(b"\n".join(buf) + b"\n")
+                    buf, size = [], 0
+            if buf:
+                self._chunk(b"\n".join(buf) + b"\n")
+        except Exception as e:
+            # статус уже отправлен — обрываем соединение, чтобы клиент не принял неполный ответ за целый
+            print(f"LogServer: Ошибка выполнения запроса: {e}")
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def _echo(self, records):
+        if self.echo:
+            print_records(records)
+
     def do_POST(self):
         parsed = urlparse(self.path)
-        if parsed.path != "/log":
-            self.send_response(404)
-            self.end_headers()
-            return
-        
         length = int(self.headers.get('content-length', 0))
+        if length > MAX_BODY:
+            self.close_connection = True
+            self._reply(413, "Слишком большой запрос".encode("utf-8"))
+            return
         body = self.rfile.read(length)
-        
+
+        if parsed.path not in ("/log", "/log/batch"):
+            self._reply(404)
+            return
+
         try:
-            data = json.loads(body.decode('utf-8'))
-            sender = data.get("sender", "unknown")
-            message = data.get("message", "")
-            level = data.get("level", "INFO")
-            
-            # ВЫВОД В КОНСОЛЬ ЛОГСЕРВЕРА
-            print(f"LogServer: [{sender}] {level} - {message}")
-            
-            fname = os.path.join(LOG_DIR, f"{sender}.log")
-            with open(fname, "a", encoding="utf-8") as f:
-                f.write(json.dumps(data, ensure_ascii=False) + "\n")
-            
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"OK")
-            
+            if parsed.path == "/log":
+                data = json.loads(body.decode('utf-8'))
+                self._echo([data])
+                self.store.append(data)
+                self.stats.add([data])
+                self._reply(200, b"OK")
+            else:
+                records = parse_records(body)
+                self._echo(records)
+                by_sender = {}
+                for r in records:
+                    by_sender.setdefault(safe_sender(r.get("sender", "unknown")), []).append(r)
+                for sender, items in by_sender.items():
+                    self.store.append_many(sender, items)
+                self.stats.add(records)
+                self._reply(200, json.dumps({"accepted": len(records)}).encode("utf-8"), "application/json")
+
         except Exception as e:
             print(f"LogServer: Ошибка обработки лога: {e}")
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(str(e).encode('utf-8'))
+            self._reply(400, str(e).encode('utf-8'))
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/ingest":
+            self._reply(200, json.dumps(self.meter.snapshot()).encode("utf-8"), "application/json")
+        elif parsed.path == "/query":
+            # пример: /query?sender=server2&level=WARN&since=3600&q=timeout
+            try:
+                params = parse_query(parsed.query)
+            except ValueError as e:
+                self._reply(400, str(e).encode("utf-8"))
+                return
+            self._stream(self.store.query(**params))
+        elif parsed.path == "/stats":
+            # пример: /stats?window=300&sender=server1&level=ERROR
+            try:
+                params = parse_stats_query(parsed.query)
+            except ValueError as e:
+                self._reply(400, str(e).encode("utf-8"))
+                return
+            self._reply(200, json.dumps(self.stats.query(**params), ensure_ascii=False).encode("utf-8"),
+                        "application/json")
+        elif parsed.path == "/segments":
+            self._reply(200, json.dumps(self.store.segments(), ensure_ascii=False).encode("utf-8"), "application/json")
+        else:
+            self._reply(404)
 
     def log_message(self, format, *args):
         # Подавляем стандартные логи сервера
         return
 
+
+class StreamHandler(socketserver.BaseRequestHandler):
+    """Одно TCP-соединение потока записей: NDJSON от клиента, кумулятивные ACK в ответ."""
+    store = None
+    stats = None
+    echo = ECHO
+
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buf = bytearray()
+        processed = rejected = 0
+        acked = 0
+        last_ack = time.monotonic()
+        try:
+            while True:
+                data = sock.recv(STREAM_RECV)
+                if not data:
+                    break
+                buf += data
+                end = buf.rfind(b"\n")
+                if end < 0:
+                    if len(buf) > MAX_BODY:
+                        print("LogServer: слишком длинная строка в потоке записей, соединение закрыто")
+                        break
+                    continue
+                lines = bytes(buf[:end]).split(b"\n")
+                del buf[:end + 1]
+                n, bad = self._ingest(lines)
+                processed += n
+                rejected += bad
+                now = time.monotonic()
+                # короткое чтение — клиент всё отправленное уже получил, подтверждаем сразу
+                if processed - acked >= ACK_RECORDS or now - last_ack >= ACK_INTERVAL or len(data) < STREAM_RECV:
+                    sock.sendall(json.dumps({"ack": processed, "rejected": rejected}).encode("utf-8") + b"\n")
+                    acked, last_ack = processed, now
+        except OSError as e:
+            print(f"LogServer: поток записей {self.client_address} прерван: {e}")
+
+    def _ingest(self, lines):
+        by_sender = {}
+        names = {}
+        count = bad = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            count += 1
+            try:
+                r = json.loads(line)
+            except ValueError:
+                bad += 1
+                continue
+            if not isinstance(r, dict):
+                bad += 1
+                continue
+            sender = r.get("sender", "unknown")
+            # отправитель может быть чем угодно (список, объект) — ключ только безопасное имя
+            name = names.get(sender) if isinstance(sender, str) else None
+            if name is None:
+                name = safe_sender(sender)
+                if isinstance(sender, str):
+                    names[sender] = name
+            by_sender.setdefault(name, []).append((r, line))
+        for sender, items in by_sender.items():
+            if self.echo:
+                print_records([r for r, _ in items])
+            self.store.append_raw(sender, items)
+            self.stats.add([r for r, _ in items])
+        return count, bad
+
+
+class StreamServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
 def run():
-    server = HTTPServer(("", PORT), Handler)
-    print(f"LogServer запущен на порту {PORT}")
+    parser = argparse.ArgumentParser(description="Централизованный LogServer")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--stream-port", type=int, default=STREAM_PORT, help="TCP-приём потока записей (0 — выключен)")
+    parser.add_argument("--quiet", action="store_true", help="не печатать каждую запись в консоль")
+    parser.add_argument("--flush", choices=("always", "interval", "none"), default=log_store.FLUSH_POLICY,
+                        help="когда сбрасывать буфер файла на диск")
+    parser.add_argument("--flush-interval", type=float, default=log_store.FLUSH_INTERVAL)
+    parser.add_argument("--fsync", action="store_true", help="os.fsync после каждого сброса")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL)
+    parser.add_argument("--segment-bytes", type=int, default=log_store.SEGMENT_MAX_BYTES,
+                        help="закрывать активный файл в сегмент по размеру, байт (0 — нет)")
+    parser.add_argument("--segment-age", type=float, default=log_store.SEGMENT_MAX_AGE,
+                        help="закрывать активный файл в сегмент по возрасту, с (0 — нет)")
+    parser.add_argument("--retention-bytes", type=int, default=log_store.RETENTION_BYTES,
+                        help="максимальный суммарный размер сегментов, байт (0 — без ограничения)")
+    parser.add_argument("--retention-age", type=float, default=log_store.RETENTION_AGE,
+                        help="удалять сегменты старше, с (0 — без ограничения)")
+    args = parser.parse_args()
+
+    store = LogStore(LOG_DIR, flush_policy=args.flush, flush_interval=args.flush_interval, fsync=args.fsync,
+                     segment_bytes=args.segment_bytes, segment_age=args.segment_age,
+                     retention_bytes=args.retention_bytes, retention_age=args.retention_age)
+    Handler.store = store
+    Handler.meter = IngestMeter(store)
+    Handler.stats = LogStats()
+    Handler.echo = ECHO and not args.quiet
+    if args.stats_interval > 0:
+        threading.Thread(target=Handler.meter.report_forever, args=(args.stats_interval,), daemon=True).start()
+
+    StreamHandler.store = store
+    StreamHandler.stats = Handler.stats
+    StreamHandler.echo = Handler.echo
+    if args.stream_port:
+        stream = StreamServer(("", args.stream_port), StreamHandler)
+        threading.Thread(target=stream.serve_forever, name="log-stream", daemon=True).start()
+        print(f"LogServer: приём потока записей по TCP на порту {args.stream_port}")
+
+    server = ThreadingHTTPServer(("", args.port), Handler)
+    server.daemon_threads = True
+    print(f"LogServer запущен на порту {args.port}")
     print(f"Логи сохраняются в: {LOG_DIR}")
     print("Ожидание лог-сообщений...")
-    
+
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    except (ValueError, AttributeError):
+        pass
     try:
         server.serve_forever()
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         print("\n🔌 LogServer остановлен")
-        server.shutdown()
+    finally:
+        server.server_close()
+        store.close()
 
 if __name__ == "__main__":
     run()
-
@@ -0,0 +1,149 @@
+# Лёгкие метрики серверов: счётчики и гистограммы с заранее выделенными корзинами.
+# Пояснение: на горячем пути — только увеличение целых чисел и bisect по короткому кортежу
+# границ; снимок (dict) собирается лишь по запросу METRICS или GET /metrics на боковом порту.
+import json
+import time
+import bisect
+import asyncio
+
+# Границы корзин гистограмм длительностей, с
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LAG_PROBE_INTERVAL = 0.5
+TOP_QUEUES = 10
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count", "max")
+
+    def __init__(self, bounds=DURATION_BUCKETS):
+        self.bounds = tuple(bounds)
+        # последняя корзина — всё, что больше последней границы
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # верхняя граница корзины, в которую попадает квантиль
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {"count": self.count, "sum": round(self.total, 6), "max": round(self.max, 6),
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99),
+                "buckets": {("+inf" if i == len(self.bounds) else str(self.bounds[i])): c
+                            for i, c in enumerate(self.counts) if c}}
+
+
+class LoopLagProbe:
+    """Задержка цикла событий: насколько позже заказанного просыпается sleep()."""
+
+    def __init__(self, interval=LAG_PROBE_INTERVAL, histogram=None):
+        self.interval = interval
+        self.histogram = histogram
+        self.samples = [] if histogram is None else None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - t0 - self.interval
+            if self.histogram is not None:
+                self.histogram.observe(max(lag, 0.0))
+            else:
+                self.samples.append(lag * 1e3)
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.fanout_seconds = Histogram()
+        self.sample_seconds = Histogram()
+        self.loop_lag_seconds = Histogram()
+
+    def count_frame(self, nbytes, frames=1):
+        self.frames_sent += frames
+        self.bytes_sent += nbytes
+
+    def snapshot(self, server):
+        depths = []
+        coalesced = 0
+        filtered = 0
+        for sub in server.fanout.subscribers.values():
+            transport = sub.writer.transport
+            buffered = transport.get_write_buffer_size() if transport is not None else 0
+            depths.append((len(sub.control) + (sub.latest is not None), buffered,
+                           str(sub.writer.get_extra_info("peername"))))
+            coalesced += sub.coalesced
+            filtered += sub.filtered
+        depths.sort(reverse=True)
+        return {
+            "server": server.NAME,
+            "uptime": round(time.time() - self.started, 1),
+            "version": server.version,
+            "clients": len(server.clients_last),
+            "subscribers": len(server.fanout),
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "evicted": server.fanout.evicted,
+            "coalesced": coalesced,
+            "filtered": filtered,
+            "queue_depth": {
+                "max": depths[0][0] if depths else 0,
+                "total": sum(d[0] for d in depths),
+                "buffered_bytes": sum(d[1] for d in depths),
+                "top": [{"peer": p, "frames": d, "buffered_bytes": b} for d, b, p in depths[:TOP_QUEUES]],
+            },
+            "fanout_seconds": self.fanout_seconds.snapshot(),
+            "sample_seconds": self.sample_seconds.snapshot(),
+            "loop_lag_seconds": self.loop_lag_seconds.snapshot(),
+            "sampler": {"samples": server.scheduler.samples, "changes": server.scheduler.changes,
+                        "interval": server.scheduler.interval, **server.detector.snapshot()},
+            "compression": server.compression.snapshot(),
+            "watchdog": server.watchdog.snapshot(),
+            "profiler": server.profiler.snapshot(),
+            "history": ({"records": len(server.history), "memory_bytes": server.history.memory_bytes()}
+                        if server.history is not None else None),
+        }
+
+
+async def serve_metrics_http(server, host, port):
+    """Боковой HTTP-порт: GET /metrics отдаёт снимок метрик в JSON."""
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                body = json.dumps(server.metrics.snapshot(server), ensure_ascii=False).encode("utf-8")
+                status = "200 OK"
+            else:
+                body, status = b"not found", "404 Not Found"
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,321 @@
+# Безголовая клиентская библиотека для Server1/Server2 и шлюза — без Tk.
+# Пояснение: MonitorClient держит по соединению на сервер (ServerLink) внутри цикла событий
+# вызывающего кода, согласует формат (HELLO), применяет кадры DELTA к локальной копии и отдаёт
+# готовые данные структурированно: Sample(tag, version, payload) через on_data или через
+# асинхронный итератор updates(). Состояние соединений — через on_status(tag, status, detail).
+# Переподключение — экспоненциальная пауза с потолком и случайным разбросом, чтобы после
+# перезапуска сервера клиенты не приходили к нему все одновременно.
+#
+# Команды на несколько серверов (send_all, subscribe, poll) сначала записываются во все
+# соединения — по одной записи на соединение, — и только потом ожидается общий drain.
+#
+#   client = MonitorClient({"s1": ("localhost", 8081), "s2": ("localhost", 8082)}, subscribe=True)
+#   client.start()
+#   async for sample in client.updates():
+#       print(sample.tag, sample.payload)
+import random
+import asyncio
+import inspect
+import collections
+
+from codec import Connection, ProtocolError, client_hello
+
+FRAME_FORMATS = ("bin", "json")   # форматы кадров в порядке предпочтения; ("json",) — без HELLO
+COMPRESSION = ()                  # ("zlib",) — сжатие потока
+POLL_INTERVAL_DEFAULT = 3
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 30.0
+UPDATES_QUEUE_MAX = 1000          # очередь updates(); при переполнении выбрасываются старые
+
+Sample = collections.namedtuple("Sample", "tag version payload")
+
+
+def parse_hostport(s, default_port, strict=False):
+    """'host:port' -> (host, port). Пусто — localhost; без порта — default_port. Неверный порт:
+    strict=False (поле ввода окна) — default_port, strict=True (командная строка) — ValueError."""
+    s = (s or "").strip()
+    if not s:
+        return "localhost", default_port
+    host, sep, port = s.rpartition(":")
+    if not sep:
+        return s, default_port
+    try:
+        return host or "localhost", int(port)
+    except ValueError:
+        if strict:
+            raise ValueError(f"неверный порт в адресе {s!r}")
+        return host or "localhost", default_port
+
+
+def backoff(min_delay=RECONNECT_MIN, max_delay=RECONNECT_MAX):
+    """Бесконечная последовательность пауз: удвоение до max_delay, случайная половина паузы."""
+    delay = min_delay
+    while True:
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay = min(delay * 2, max_delay)
+
+
+class ServerLink:
+    """Соединение с одним сервером: переподключение, HELLO, применение DATA/DELTA."""
+
+    def __init__(self, client, tag, addr):
+        self.client = client
+        self.tag = tag
+        self.addr = addr
+        self.conn = None
+        self.version = 0
+        self.state = None
+        self.connected = False
+        self.reconnects = 0
+        self.task = None
+
+    @property
+    def active(self):
+        return self.task is not None and not self.task.done()
+
+    async def run(self):
+        c = self.client
+        delays = backoff(c.reconnect_min, c.reconnect_max)
+        while True:
+            host, port = self.addr
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                conn = Connection(reader, writer)
+                if tuple(c.formats) != ("json",) or c.compression:
+                    try:
+                        await client_hello(conn, c.formats, c.compression)
+                    except asyncio.TimeoutError:
+                        c._status(self.tag, "hello_timeout", None)
+                # после переподключения версия сервера могла начаться заново
+                self.version = 0
+                self.conn = conn
+                self.connected = True
+                delays = backoff(c.reconnect_min, c.reconnect_max)
+                c._status(self.tag, "connected", {"host": host, "port": port, "codec": conn.codec.name,
+                                                  "compress": conn.compressor is not None})
+                if c.subscribed:
+                    await self.send(c.register_command())
+                elif c.auto_poll:
+                    await self.poll()
+                await self._listen(conn)
+            except (OSError, asyncio.IncompleteReadError, ProtocolError) as e:
+                c._status(self.tag, "error", f"{host}:{port}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # испорченный поток (zlib), кадр не того вида и т.п. — соединение переустанавливается
+                c._status(self.tag, "error", f"{host}:{port}: {e!r}")
+            finally:
+                self.conn = None
+                if writer is not None:
+                    writer.close()
+            if self.connected:
+                self.connected = False
+                self.reconnects += 1
+                c._status(self.tag, "disconnected", None)
+            await asyncio.sleep(next(delays))
+
+    async def _listen(self, conn):
+        while True:
+            msg = await conn.recv()
+            if msg is None:
+                return
+            t = msg.get("type")
+            if t == "DATA":
+                self.state = dict(msg.get("payload", {}))
+            elif t == "DELTA":
+                if self.state is None or msg.get("base") != self.version:
+                    # пропущена версия — запрашиваем полный кадр
+                    await self.send({"type": "POLL", "version": 0, "delta": True})
+                    continue
+                self.state.update(msg.get("changes", {}))
+            elif t == "NOT_MODIFIED":
+                # данные не изменились с прошлого опроса
+                continue
+            else:
+                # ACK и прочие служебные ответы
+                self.client._status(self.tag, "message", msg)
+                continue
+            self.version = msg.get("version", 0)
+            await self.client._deliver(Sample(self.tag, self.version, dict(self.state)))
+
+    def write(self, objs):
+        """Записывает команды objs одной записью без ожидания drain; False — соединения нет."""
+        conn = self.conn
+        if conn is None or conn.writer.is_closing():
+            return False
+        try:
+            conn.write_many(objs)
+            return True
+        except OSError as e:
+            self.client._status(self.tag, "error", f"отправка: {e}")
+            return False
+
+    async def drain(self):
+        conn = self.conn
+        if conn is None:
+            return False
+        try:
+            await conn.writer.drain()
+            return True
+        except OSError as e:
+            self.client._status(self.tag, "error", f"отправка: {e}")
+            return False
+
+    async def send(self, obj):
+        return self.write([obj]) and await self.drain()
+
+    def poll_command(self):
+        return {"type": "POLL", "version": self.version, "delta": True}
+
+    async def poll(self):
+        return await self.send(self.poll_command())
+
+
+class MonitorClient:
+    def __init__(self, servers, on_data=None, on_status=None, poll_interval=POLL_INTERVAL_DEFAULT,
+                 subscribe=False, auto_poll=True, formats=FRAME_FORMATS, compression=COMPRESSION,
+                 reconnect_min=RECONNECT_MIN, reconnect_max=RECONNECT_MAX, queue_max=UPDATES_QUEUE_MAX,
+                 register=None):
+        # servers: tag -> (host, port); on_data(sample) и on_status(tag, status, detail) —
+        # функции или корутины. status: connected | disconnected | error | hello_timeout | message | closed
+        # register — условия подписки для REGISTER: {"fields": [...], "min_interval": с, "thresholds": {...}}
+        self.links = {tag: ServerLink(self, tag, addr) for tag, addr in servers.items()}
+        self.on_data = on_data
+        self.on_status = on_status
+        self.poll_interval = poll_interval
+        self.subscribed = subscribe
+        self.auto_poll = auto_poll
+        self.formats = tuple(formats)
+        self.compression = tuple(compression)
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self.queue_max = queue_max
+        self.register = dict(register or {})
+        self._queue = None
+        self._poller = None
+        self._closed = None
+        self._status_tasks = set()
+
+    def start(self, tags=None):
+        """Подключает серверы tags (по умолчанию все) и запускает автоопрос. Вызывать в цикле событий."""
+        # очередь updates() создаётся до первых соединений, чтобы первый DATA не потерялся
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.queue_max)
+        for tag in self.links if tags is None else tags:
+            self.connect(tag)
+        if self._poller is None:
+            self._poller = asyncio.ensure_future(self._poll_loop())
+
+    async def run(self):
+        """start() и ожидание close()."""
+        self._closed = self._closed or asyncio.Event()
+        self.start()
+        await self._closed.wait()
+
+    def connect(self, tag):
+        link = self.links[tag]
+        if not link.active:
+            link.task = asyncio.ensure_future(link.run())
+
+    async def disconnect(self, tag):
+        link = self.links[tag]
+        if link.connected and self.subscribed:
+            await link.send({"type": "UNREGISTER"})
+        if link.task is not None:
+            link.task.cancel()
+            try:
+                await link.task
+            except asyncio.CancelledError:
+                pass
+            link.task = None
+        link.connected = False
+        self._status(tag, "closed", None)
+
+    async def subscribe(self, flag=True):
+        """REGISTER/UNREGISTER на всех подключённых серверах; возвращает число успешных отправок."""
+        self.subscribed = bool(flag)
+        command = self.register_command() if flag else {"type": "UNREGISTER"}
+        return await self.send_all({tag: [command] for tag in self.links})
+
+    async def send_all(self, commands):
+        """commands: tag -> список команд. Запись во все подключённые соединения, затем общий drain.
+        Возвращает число соединений, куда команды отправлены."""
+        written = []
+        for tag, objs in commands.items():
+            link = self.links[tag]
+            if link.connected and link.write(objs):
+                written.append(link)
+        if not written:
+            return 0
+        results = await asyncio.gather(*(link.drain() for link in written))
+        return sum(1 for ok in results if ok)
+
+    def register_command(self):
+        return {"type": "REGISTER", "delta": True, **self.register}
+
+    async def poll(self):
+        await self.send_all({tag: [link.poll_command()] for tag, link in self.links.items()})
+
+    async def _poll_loop(self):
+        while True:
+            if self.auto_poll and not self.subscribed:
+                await self.poll()
+            await asyncio.sleep(self.poll_interval)
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        for tag, link in self.links.items():
+            if link.active:
+                await self.disconnect(tag)
+        if self._closed is not None:
+            self._closed.set()
+
+    def latest(self, tag):
+        state = self.links[tag].state
+        return dict(state) if state is not None else None
+
+    async def updates(self):
+        """Асинхронный итератор Sample; если читатель отстаёт, старые выборки выбрасываются."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.queue_max)
+        while True:
+            yield await self._queue.get()
+
+    async def _deliver(self, sample):
+        if self.on_data is not None:
+            # ошибка в обработчике не должна обрывать соединение
+            try:
+                result = self.on_data(sample)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self._status(sample.tag, "error", f"on_data: {e!r}")
+        if self._queue is not None:
+            if self._queue.full():
+                self._queue.get_nowait()
+            self._queue.put_nowait(sample)
+
+    def _status(self, tag, status, detail):
+        if self.on_status is None:
+            return
+        try:
+            result = self.on_status(tag, status, detail)
+        except Exception as e:
+            print(f"MonitorClient: ошибка в on_status: {e!r}")
+            return
+        if inspect.isawaitable(result):
+            # _status вызывается и из синхронного кода — корутина выполняется отдельной задачей
+            task = asyncio.ensure_future(self._await_status(result))
+            self._status_tasks.add(task)
+            task.add_done_callback(self._status_tasks.discard)
+
+    @staticmethod
+    async def _await_status(result):
+        try:
+            await result
+        except Exception as e:
+            print(f"MonitorClient: ошибка в on_status: {e!r}")
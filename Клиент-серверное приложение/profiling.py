@@ -0,0 +1,185 @@
+# Диагностика зависаний серверов: профилирование по запросу и сторож задержки цикла событий.
+# Пояснение: Profiler включает cProfile (mode "cpu") или tracemalloc (mode "mem") на ограниченное
+# окно и по его окончании пишет в logs/profiles/ статистику функций или top-N мест выделения
+# памяти. Пока профилирование выключено, затрат нет вовсе. Включается командой PROFILE
+# (только с локального адреса) или сигналами SIGUSR1 (cpu) / SIGUSR2 (mem).
+# LagWatchdog работает всегда: цикл событий раз в interval отмечает «пульс», а отдельный поток
+# проверяет его. Если пульса нет дольше threshold, поток снимает стек потока цикла событий —
+# то есть видно код, который его держит (send_log, опрос Tk, кодирование JSON и т.п.).
+import io
+import os
+import sys
+import time
+import pstats
+import asyncio
+import cProfile
+import threading
+import traceback
+import tracemalloc
+import collections
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+PROFILE_DIR = os.path.join(BASE, "logs", "profiles")
+
+PROFILE_SECONDS = 10.0
+PROFILE_MAX_SECONDS = 300.0
+PROFILE_TOP = 40
+PROFILE_MODES = ("cpu", "mem")
+TRACEMALLOC_FRAMES = 10
+
+WATCHDOG_INTERVAL = 0.1      # период пульса цикла событий, с
+WATCHDOG_THRESHOLD = 0.5     # задержка, после которой снимается стек, с
+WATCHDOG_KEEP = 20           # последних зависаний в памяти (для METRICS)
+
+
+def _stamp():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+class Profiler:
+    def __init__(self, name, directory=PROFILE_DIR):
+        self.name = name
+        self.directory = directory
+        self.mode = None
+        self.until = None
+        self._profile = None
+        self._timer = None
+        self.files = []
+
+    @property
+    def active(self):
+        return self.mode is not None
+
+    def start(self, mode="cpu", seconds=PROFILE_SECONDS, top=PROFILE_TOP):
+        """Включает профилирование на seconds секунд; возвращает путь будущего отчёта."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode должен быть одним из {PROFILE_MODES}")
+        seconds = float(seconds)
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds должен быть в (0, {PROFILE_MAX_SECONDS:g}]")
+        top = int(top)
+        if self.active:
+            raise RuntimeError(f"уже идёт профилирование ({self.mode})")
+        path = os.path.join(self.directory, f"{self.name}-{mode}-{_stamp()}-{os.getpid()}.txt")
+        if mode == "cpu":
+            # cProfile видит только поток, в котором включён, — поток цикла событий
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.mode = mode
+        self.until = time.time() + seconds
+        self._timer = asyncio.get_running_loop().call_later(seconds, self.stop, path, top)
+        print(f"{self.name}: профилирование {mode} на {seconds:g} с -> {path}")
+        return path
+
+    def stop(self, path, top=PROFILE_TOP):
+        if not self.active:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        mode, self.mode, self.until = self.mode, None, None
+        if mode == "cpu":
+            profile, self._profile = self._profile, None
+            profile.disable()
+            report = lambda: self._cpu_report(profile, top)
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report = lambda: self._mem_report(snapshot, traced, top)
+        # форматирование и запись на диск — вне цикла событий
+        asyncio.get_running_loop().run_in_executor(None, self._write, path, report)
+
+    def _write(self, path, report):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(report())
+            self.files.append(path)
+            print(f"{self.name}: отчёт профилирования записан: {path}")
+        except Exception as e:
+            print(f"{self.name}: не удалось записать отчёт профилирования: {e}")
+
+    @staticmethod
+    def _cpu_report(profile, top):
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(top)
+        stats.sort_stats("tottime").print_stats(top)
+        return out.getvalue()
+
+    @staticmethod
+    def _mem_report(snapshot, traced, top):
+        current, peak = traced
+        lines = [f"tracemalloc: текущий объём {current / 1024:.1f} КБ, пик {peak / 1024:.1f} КБ", ""]
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        for i, stat in enumerate(snapshot.statistics("traceback")[:top], 1):
+            lines.append(f"#{i}: {stat.size / 1024:.1f} КБ в {stat.count} блоках")
+            lines.extend("    " + line for line in stat.traceback.format(limit=TRACEMALLOC_FRAMES // 2, most_recent_first=True))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {"mode": self.mode, "until": self.until, "reports": self.files[-5:]}
+
+
+class LagWatchdog:
+    def __init__(self, name, threshold=WATCHDOG_THRESHOLD, interval=WATCHDOG_INTERVAL,
+                 directory=PROFILE_DIR, keep=WATCHDOG_KEEP):
+        self.name = name
+        self.threshold = threshold
+        self.interval = interval
+        self.path = os.path.join(directory, f"{name}-stalls.txt")
+        self.stalls = 0
+        self.recent = collections.deque(maxlen=keep)
+        self._beat = time.monotonic()
+        self._loop = None
+        self._thread_id = None
+        self._stop = threading.Event()
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._loop.call_soon(self._pulse)
+        threading.Thread(target=self._watch, name=f"{self.name}-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _pulse(self):
+        # единственная работа в цикле событий: отметка времени и перезапуск таймера
+        self._beat = time.monotonic()
+        if not self._stop.is_set():
+            self._loop.call_later(self.interval, self._pulse)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval
+            if lag < self.threshold or beat == reported:
+                continue
+            # одно зависание — один снимок стека
+            reported = beat
+            frame = sys._current_frames().get(self._thread_id)
+            summary = traceback.extract_stack(frame) if frame is not None else []
+            self._record(lag, summary)
+
+    def _record(self, lag, summary):
+        self.stalls += 1
+        ts = time.time()
+        where = f"{os.path.basename(summary[-1].filename)}:{summary[-1].lineno} {summary[-1].name}" if summary else None
+        self.recent.append({"ts": round(ts, 3), "lag": round(lag, 3), "where": where})
+        stack = "".join(summary.format()) if summary else ""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"--- {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))} "
+                        f"pid {os.getpid()}: цикл событий не отвечает {lag:.3f} с\n{stack}\n")
+        except OSError as e:
+            print(f"{self.name}: не удалось записать стек зависания: {e}")
+
+    def snapshot(self):
+        return {"threshold": self.threshold, "stalls": self.stalls, "recent": list(self.recent)}
@@ -0,0 +1,151 @@
+# Ретранслятор: одна подписка на Server1/Server2 (или на другой ретранслятор) на много клиентов.
+# Пояснение: relay подписывается на вышестоящий сервер (HELLO + REGISTER с дельтами) и раздаёт
+# тот же поток своим подписчикам по тому же протоколу (MonitorServer), поэтому ретрансляторы
+# можно соединять в дерево: сервер -> relay -> relay -> клиенты. Опрос данных выполняет только
+# исходный сервер; ретранслятор сохраняет его версии, так что POLL с версией и дельты работают
+# одинаково на любом уровне. Кадры DATA/DELTA от вышестоящего сервера уже закодированы — они
+# передаются подписчикам с тем же форматом (bin или json) как есть, без повторного кодирования.
+# Новый клиент сразу получает последний кэшированный снимок.
+#
+# Пример: python relay.py --upstream localhost:8082 --port 9082
+#         python relay.py --upstream localhost:9082 --port 9182     (второй уровень)
+import os
+import sys
+import asyncio
+import argparse
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE)
+sys.path.insert(0, BASE)
+
+from server_base import send_log, run_server, MonitorServer
+from codec import Connection, ProtocolError, SCHEMAS, client_hello
+from monitor_client import backoff, parse_hostport
+
+HOST = "0.0.0.0"
+PORT = 9080
+SERVER_NAME = "relay"
+
+UPSTREAM_FORMATS = ("bin", "json")
+UPSTREAM_COMPRESSION = ()
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 10.0
+
+
+async def probe_schema(host, port, formats=UPSTREAM_FORMATS):
+    """Схема вышестоящего сервера из ответа на HELLO (None — сервер отдаёт только JSON)."""
+    delays = backoff(RECONNECT_MIN, RECONNECT_MAX)
+    while True:
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            conn = Connection(reader, writer)
+            codec = await client_hello(conn, formats)
+            return getattr(codec, "schema", None)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ProtocolError) as e:
+            print(f"Relay: вышестоящий сервер {host}:{port} недоступен: {e}")
+        finally:
+            if writer is not None:
+                writer.close()
+        await asyncio.sleep(next(delays))
+
+
+class Relay(MonitorServer):
+    NAME = "Relay"
+    SERVER_NAME = SERVER_NAME
+    HISTORY_SIZE = 0     # история есть у исходного сервера
+
+    def __init__(self, upstream, schema=None):
+        self.SCHEMA = schema
+        self.FIELDS = tuple(f for f, _ in SCHEMAS.get(schema, ()) if f != "ts")
+        super().__init__()
+        self.upstream = upstream
+        self.upstream_conn = None
+        self.forwarded = 0   # кадров, переданных подписчикам без повторного кодирования
+        self.reconnects = 0
+
+    async def follow_upstream(self):
+        host, port = self.upstream
+        delays = backoff(RECONNECT_MIN, RECONNECT_MAX)
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                conn = Connection(reader, writer)
+                await client_hello(conn, UPSTREAM_FORMATS, UPSTREAM_COMPRESSION)
+                # версия 0 — вышестоящий сервер мог перезапуститься, первым придёт полный кадр
+                self.upstream_conn = conn
+                await conn.send({"type": "REGISTER", "delta": True})
+                delays = backoff(RECONNECT_MIN, RECONNECT_MAX)
+                print(f"Relay: подписка на {host}:{port} ({conn.codec.name})")
+                send_log(SERVER_NAME, "INFO", f"Upstream connected {host}:{port}")
+                while True:
+                    msg, raw = await conn.recv_frame()
+                    if msg is None:
+                        break
+                    await self.on_upstream_frame(conn, msg, raw)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ProtocolError) as e:
+                print(f"Relay: {host}:{port} недоступен: {e}")
+            finally:
+                if writer is not None:
+                    writer.close()
+                if self.upstream_conn is not None:
+                    self.upstream_conn = None
+                    self.reconnects += 1
+                    send_log(SERVER_NAME, "WARN", f"Upstream disconnected {host}:{port}")
+            await asyncio.sleep(next(delays))
+
+    async def on_upstream_frame(self, conn, msg, raw):
+        t = msg.get("type")
+        if t == "DATA":
+            data = msg.get("payload", {})
+        elif t == "DELTA":
+            if self.current is None or msg.get("base") != self.version:
+                # пропущена версия — запрашиваем полный кадр
+                await conn.send({"type": "POLL", "version": 0, "delta": True})
+                return
+            data = dict(self.current)
+            data.update(msg.get("changes", {}))
+        else:
+            # ACK и прочие служебные ответы
+            return
+        if not self.accept_snapshot(msg.get("version", 0), data):
+            return
+        update = self.current_update
+        # свой кадр совпадает с полученным, если это полный кадр или дельта к той же базе
+        if raw is not None and (t == "DATA" or (update.changes is not None and msg.get("base") == update.base)):
+            update.seed(t, conn.codec, raw)
+            self.forwarded += 1
+        await self.notify_subscribers(data)
+
+    async def start_monitor(self):
+        self.start_probes()
+        await self.follow_upstream()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Ретранслятор потока Server1/Server2")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--upstream", required=True, help="адрес сервера или другого ретранслятора (host:port)")
+    parser.add_argument("--schema", choices=sorted(SCHEMAS), default=None,
+                        help="схема полей; по умолчанию узнаётся у вышестоящего сервера через HELLO")
+    args = parser.parse_args()
+
+    try:
+        upstream = parse_hostport(args.upstream, PORT, strict=True)
+    except ValueError as e:
+        parser.error(str(e))
+    schema = args.schema or await probe_schema(*upstream)
+    r = Relay(upstream, schema)
+    asyncio.create_task(r.start_monitor())
+    srv = await asyncio.start_server(r.handle_client, HOST, args.port)
+
+    print(f"Relay запущен на {HOST}:{args.port}, источник {upstream[0]}:{upstream[1]} (схема {schema})")
+    send_log(SERVER_NAME, "INFO", f"Started on {HOST}:{args.port}, upstream {upstream[0]}:{upstream[1]}")
+
+    async with srv:
+        await srv.serve_forever()
+
+
+if __name__ == "__main__":
+    run_server(main)
@@ -0,0 +1,150 @@
+# Планировщик опроса данных для start_monitor.
+# Пояснение: функция опроса (psutil и т.п.) выполняется в пуле потоков, а не в цикле событий.
+# Интервал подстраивается под частоту изменений: пока значения меняются — опрашиваем с
+# минимальным интервалом, пока стабильны — интервал растёт до максимального.
+# Изменение определяется сравнением «отпечатка» — кортежа значений полей, без сборки словарей.
+# Необязательный ChangeDetector решает, значимо ли изменение: по полям задаются зоны
+# нечувствительности (абсолютные или в процентах), минимальное время удержания между
+# публикациями и принудительная публикация после максимального молчания. Незначимые
+# изменения не публикуются (нет push и записи «Data changed»), но учитываются в счётчиках.
+import time
+import asyncio
+import concurrent.futures
+
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 5.0
+BACKOFF = 1.5
+
+HOLD_TIME = 0.0       # минимум секунд между публикациями
+MAX_SILENCE = None    # через сколько секунд публиковать даже незначимое изменение (None — никогда)
+
+SAMPLER_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="sampler")
+
+
+def parse_threshold(value):
+    """Порог изменения: число — абсолютный, строка "N%" — относительный. -> (абс., отн.)"""
+    if isinstance(value, str) and value.endswith("%"):
+        return 0.0, float(value[:-1]) / 100.0
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value), 0.0
+    raise ValueError(f"порог должен быть числом или строкой вида \"5%\": {value!r}")
+
+
+def significant(old, new, limit):
+    """Превышает ли изменение old -> new порог limit из parse_threshold (None — любое изменение)."""
+    if old == new:
+        return False
+    if limit is None:
+        return True
+    try:
+        diff = abs(new - old)
+        return diff >= limit[0] and diff >= limit[1] * abs(old)
+    except TypeError:
+        # нечисловые значения сравниваются только на равенство
+        return True
+
+
+class ChangeDetector:
+    def __init__(self, fields, rules=None, hold=HOLD_TIME, max_silence=MAX_SILENCE):
+        # rules: поле -> порог (см. parse_threshold); поля без правила значимы при любом изменении
+        rules = rules or {}
+        unknown = set(rules) - set(fields)
+        if unknown:
+            raise ValueError(f"правила для неизвестных полей: {sorted(unknown)}")
+        self.limits = tuple(parse_threshold(rules[f]) if f in rules else None for f in fields)
+        self.hold = hold
+        self.max_silence = max_silence
+        self.last_emit = None
+        self.emitted = 0
+        self.suppressed = 0
+        self.forced = 0
+
+    def check(self, old, new, now=None):
+        """old — последний опубликованный кортеж (None — ещё не было), new — новый, отличный от old."""
+        now = time.monotonic() if now is None else now
+        if old is None:
+            emit = True
+        elif self.max_silence is not None and now - self.last_emit >= self.max_silence:
+            emit = True
+            self.forced += 1
+        elif now - self.last_emit < self.hold:
+            emit = False
+        else:
+            emit = any(significant(o, n, limit) for o, n, limit in zip(old, new, self.limits))
+        if emit:
+            self.emitted += 1
+            self.last_emit = now
+        else:
+            self.suppressed += 1
+        return emit
+
+    def snapshot(self):
+        return {"emitted": self.emitted, "suppressed": self.suppressed, "forced": self.forced}
+
+
+class SamplingScheduler:
+    def __init__(self, sample, on_change, prepare=None, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, backoff=BACKOFF, executor=SAMPLER_EXECUTOR, observe=None,
+                 detector=None):
+        # sample() -> кортеж значений (блокирующая, выполняется в executor)
+        # on_change(values) — корутина, вызывается только при изменении отпечатка
+        # prepare() — необязательная корутина перед каждым опросом (в цикле событий)
+        # observe(seconds) — необязательный приёмник длительности опроса (гистограмма метрик)
+        # detector — необязательный ChangeDetector; без него значимо любое изменение
+        self.sample = sample
+        self.on_change = on_change
+        self.prepare = prepare
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.executor = executor
+        self.observe = observe
+        self.detector = detector
+        self.interval = min_interval
+        self.fingerprint = None
+        self.samples = 0
+        self.changes = 0
+        self.last_duration = 0.0
+        self._wake = asyncio.Event()
+
+    def trigger(self):
+        """Внеочередной опрос (например, при подключении подписчика)."""
+        self._wake.set()
+
+    async def sample_once(self):
+        if self.prepare is not None:
+            await self.prepare()
+        t0 = time.perf_counter()
+        values = await asyncio.get_running_loop().run_in_executor(self.executor, self.sample)
+        self.last_duration = time.perf_counter() - t0
+        if self.observe is not None:
+            self.observe(self.last_duration)
+        self.samples += 1
+        # отпечаток — последние опубликованные значения, поэтому медленный дрейф накапливается
+        changed = values != self.fingerprint
+        if changed and self.detector is not None:
+            changed = self.detector.check(self.fingerprint, values)
+        if changed:
+            self.fingerprint = values
+            self.changes += 1
+            await self.on_change(values)
+        return changed
+
+    async def run(self):
+        while True:
+            try:
+                changed = await self.sample_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка опроса данных: {e}")
+                changed = False
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
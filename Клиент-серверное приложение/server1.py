@@ -1,11 +1,11 @@
 import os
 import sys
 import asyncio
-import json
-import time
 import platform
 import psutil
-from server_base import send_log
+from server_base import send_log, run_server, MonitorServer
+from metrics import serve_metrics_http
+from workers import run_workers
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(BASE)
@@ -13,8 +13,19 @@ sys.path.insert(0, BASE)
 
 HOST = "0.0.0.0"
 PORT = 8081
+METRICS_PORT = None   # боковой HTTP-порт для GET /metrics (None — выключен)
+WORKERS = 1           # >1 — процессы-обработчики на одном порту (SO_REUSEPORT), см. workers.py
 SERVER_NAME = "server1"
 
+# Значимость изменений swap_free (см. sampler.ChangeDetector). По умолчанию выключена:
+# подписчики получают каждое изменение, как раньше. Включается переменными окружения,
+# например SERVER1_SWAP_THRESHOLD=1048576 (или "1%"), SERVER1_HOLD_TIME=2, SERVER1_MAX_SILENCE=60.
+SWAP_THRESHOLD = os.environ.get("SERVER1_SWAP_THRESHOLD", "").strip()
+SWAP_SIGNIFICANCE = {"swap_free": SWAP_THRESHOLD if SWAP_THRESHOLD.endswith("%") else float(SWAP_THRESHOLD)} \
+    if SWAP_THRESHOLD else {}
+SWAP_HOLD_TIME = float(os.environ.get("SERVER1_HOLD_TIME") or 0)
+SWAP_MAX_SILENCE = float(os.environ["SERVER1_MAX_SILENCE"]) if os.environ.get("SERVER1_MAX_SILENCE") else None
+
 def get_swap_info():
     try:
         swap = psutil.swap_memory()
@@ -23,110 +34,28 @@ def get_swap_info():
         print(f"Ошибка получения информации о swap: {e}")
         return 0, 0
 
-class Server1:
-    def __init__(self):
-        self.clients_last = {}
-        self.subscribers = set()
-        self.current = None
-        self.lock = asyncio.Lock()
-        self.client_count = 0
-
-    async def get_data(self):
-        total, free = get_swap_info()
-        return {"swap_total": total, "swap_free": free, "ts": int(time.time())}
-
-    async def start_monitor(self):
-        while True:
-            data = await self.get_data()
-            data_for_comparison = {k: v for k, v in data.items() if k != "ts"}
-            current_for_comparison = {k: v for k, v in (self.current or {}).items() if k != "ts"}
-            
-            async with self.lock:
-                changed = (current_for_comparison != data_for_comparison)
-                self.current = data
-            
-            if changed:
-                await self.notify_subscribers(data)
-                send_log(SERVER_NAME, "INFO", f"Data changed: {data}")
-            
-            await asyncio.sleep(1)
+class Server1(MonitorServer):
+    NAME = "Server1"
+    SERVER_NAME = SERVER_NAME
+    SCHEMA = "swap"
 
-    async def notify_subscribers(self, data):
-        dead = []
-        for w in list(self.subscribers):
-            try:
-                w.write((json.dumps({"type":"DATA","payload":data}) + "\n").encode("utf-8"))
-                await w.drain()
-                print("Server1: Отправлены данные подписчику")
-            except Exception:
-                dead.append(w)
-        for w in dead:
-            self.subscribers.discard(w)
+    FIELDS = ("swap_total", "swap_free")
+    # swap_free на загруженной машине меняется почти каждую секунду на несколько страниц;
+    # порог, например 1 МБ с HOLD_TIME 2 и MAX_SILENCE 60, сокращает push — см. SWAP_THRESHOLD
+    SIGNIFICANCE = SWAP_SIGNIFICANCE
+    HOLD_TIME = SWAP_HOLD_TIME
+    MAX_SILENCE = SWAP_MAX_SILENCE
 
-    async def handle_client(self, reader, writer):
-        addr = writer.get_extra_info('peername')
-        client_id = self.client_count + 1
-        self.client_count += 1
-        
-        print(f"Server1: Клиент #{client_id} подключился с {addr}")
-        send_log(SERVER_NAME, "INFO", f"Client connected {addr}")
-        
-        self.clients_last[writer] = None
-        
-        try:
-            while True:
-                line = await reader.readline()
-                if not line:
-                    break
-                
-                try:
-                    msg = json.loads(line.decode("utf-8").strip())
-                except Exception:
-                    continue
-                
-                t = msg.get("type")
-                if t == "REGISTER":
-                    self.subscribers.add(writer)
-                    # ОТПРАВЛЯЕМ ДАННЫЕ СРАЗУ ПРИ ПОДПИСКЕ
-                    async with self.lock:
-                        cur = self.current
-                        if cur is not None:
-                            writer.write((json.dumps({"type":"DATA","payload":cur}) + "\n").encode("utf-8"))
-                            await writer.drain()
-                            self.clients_last[writer] = cur
-                    
-                    writer.write((json.dumps({"type":"ACK","message":"REGISTERED"}) + "\n").encode("utf-8"))
-                    await writer.drain()
-                    print(f"Server1: Клиент #{client_id} подписался на push-уведомления, данные отправлены")
-                    
-                elif t == "UNREGISTER":
-                    self.subscribers.discard(writer)
-                    writer.write((json.dumps({"type":"ACK","message":"UNREGISTERED"}) + "\n").encode("utf-8"))
-                    await writer.drain()
-                    print(f"Server1: Клиент #{client_id} отписался от push-уведомлений")
-                    
-                else:
-                    writer.write((json.dumps({"type":"ACK","message":"UNKNOWN"}) + "\n").encode("utf-8"))
-                    await writer.drain()
-                    
-        except Exception as e:
-            print(f"Server1: Ошибка с клиентом #{client_id}: {e}")
-            
-        finally:
-            print(f"Server1: Клиент #{client_id} отключился")
-            send_log(SERVER_NAME, "INFO", f"Client disconnected {addr}")
-            self.subscribers.discard(writer)
-            self.clients_last.pop(writer, None)
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except Exception:
-                pass
+    def sample(self):
+        return get_swap_info()
 
 async def main():
     s = Server1()
     asyncio.create_task(s.start_monitor())
     srv = await asyncio.start_server(s.handle_client, HOST, PORT)
+    if METRICS_PORT:
+        await serve_metrics_http(s, HOST, METRICS_PORT)
+        print(f"Метрики: http://{HOST}:{METRICS_PORT}/metrics")
     
     print(f"Server1 запущен на {HOST}:{PORT}")
     print("Ожидание подключений клиентов...")
@@ -136,4 +65,5 @@ async def main():
         await srv.serve_forever()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if not run_workers(Server1, HOST, PORT, WORKERS, METRICS_PORT):
+        run_server(main)
\ No newline at end of file
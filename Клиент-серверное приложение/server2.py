@@ -1,10 +1,13 @@
 import os
 import sys
 import asyncio
-import json
 import time
+import signal
+import concurrent.futures
 import tkinter as tk
-from server_base import send_log
+from server_base import send_log, run_server, MonitorServer
+from metrics import serve_metrics_http
+from workers import run_workers
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(BASE)
@@ -12,139 +15,150 @@ sys.path.insert(0, BASE)
 
 HOST = "0.0.0.0"
 PORT = 8082
+METRICS_PORT = None   # боковой HTTP-порт для GET /metrics (None — выключен)
+WORKERS = 1           # >1 — процессы-обработчики на одном порту (SO_REUSEPORT), см. workers.py
 SERVER_NAME = "server2"
 
-class Server2:
+SCREEN_REPROBE_INTERVAL = 60.0   # как часто перепроверять разрешение экрана, с (0 — никогда)
+DEFAULT_SCREEN_SIZE = (1920, 1080)
+
+
+class HeadlessError(Exception):
+    pass
+
+
+def probe_screen_size():
+    """Однократный опрос разрешения экрана. Блокирующий — вызывать только в executor."""
+    if sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        raise HeadlessError("нет $DISPLAY")
+    try:
+        # Способ 1: через tkinter (основной)
+        root = tk.Tk()
+        root.withdraw()  # Скрываем окно
+        w = root.winfo_screenwidth()
+        h = root.winfo_screenheight()
+        root.destroy()
+        return w, h
+    except Exception as e:
+        print(f"Server2: Ошибка получения разрешения экрана через tkinter: {e}")
+        try:
+            # Способ 2: через ctypes (резервный для Windows)
+            import ctypes
+            user32 = ctypes.windll.user32
+            w = user32.GetSystemMetrics(0)  # SM_CXSCREEN
+            h = user32.GetSystemMetrics(1)  # SM_CYSCREEN
+            return w, h
+        except Exception:
+            raise HeadlessError(str(e))
+
+
+class ScreenGeometry:
+    """Кэш разрешения экрана: опрос в отдельном потоке, повтор раз в interval или после invalidate()
+    (сигнал SIGHUP — например, из хука смены мониторов)."""
+
+    def __init__(self, interval=SCREEN_REPROBE_INTERVAL, default=DEFAULT_SCREEN_SIZE):
+        self.interval = interval
+        self.default = default
+        self.size = None
+        self.headless = False
+        self.probes = 0
+        self._probed_at = 0.0
+        self._probe = None
+        self._invalid = False
+        # один поток: Tk не любит, когда его создают из разных потоков
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="screen-probe")
+
+    def invalidate(self):
+        # повторный опрос при следующем get() — независимо от interval и прежнего headless
+        self._invalid = True
+        self.headless = False
+
+    def _stale(self):
+        if self.size is None or self._invalid:
+            return True
+        if self.headless or not self.interval:
+            return False
+        return time.monotonic() - self._probed_at >= self.interval
+
+    async def _run_probe(self):
+        loop = asyncio.get_running_loop()
+        self.probes += 1
+        try:
+            self.size = await loop.run_in_executor(self._executor, probe_screen_size)
+        except HeadlessError as e:
+            # Способ 3: значения по умолчанию; без дисплея больше не пробуем
+            if not self.headless:
+                print(f"Server2: Дисплей недоступен ({e}), используется разрешение по умолчанию "
+                      f"{self.default[0]}x{self.default[1]}")
+            self.headless = True
+            self.size = self.default
+        finally:
+            self._probed_at = time.monotonic()
+            self._probe = None
+        return self.size
+
+    async def get(self):
+        if not self._stale():
+            return self.size
+        if self._probe is None:
+            self._invalid = False
+            self._probe = asyncio.ensure_future(self._run_probe())
+        if self.size is None:
+            return await self._probe
+        # пока идёт повторный опрос, отдаём прежнее значение
+        return self.size
+
+
+class Server2(MonitorServer):
+    NAME = "Server2"
+    SERVER_NAME = SERVER_NAME
+    SCHEMA = "screen"
+    FIELDS = ("uptime_seconds", "screen_width", "screen_height")
+    # uptime меняется раз в секунду — опрашивать чаще бессмысленно
+    MIN_INTERVAL = 1.0
+    MAX_INTERVAL = 1.0
+    # uptime и разрешение экрана значимы при любом изменении; порог, например
+    # {"uptime_seconds": 10}, сократит push до одного раза в 10 с
+    SIGNIFICANCE = {}
+
     def __init__(self):
-        self.clients_last = {}
-        self.subscribers = set()
-        self.current = None
-        self.lock = asyncio.Lock()
+        super().__init__()
         self.start_time = time.time()
-        self.client_count = 0
+        self.screen = ScreenGeometry()
 
     async def get_screen_size(self):
-        try:
-            # Способ 1: через tkinter (основной)
-            root = tk.Tk()
-            root.withdraw()  # Скрываем окно
-            w = root.winfo_screenwidth()
-            h = root.winfo_screenheight()
-            root.destroy()
-            return w, h
-        except Exception as e:
-            print(f"Server2: Ошибка получения разрешения экрана через tkinter: {e}")
-            try:
-                # Способ 2: через ctypes (резервный для Windows)
-                import ctypes
-                user32 = ctypes.windll.user32
-                w = user32.GetSystemMetrics(0)  # SM_CXSCREEN
-                h = user32.GetSystemMetrics(1)  # SM_CYSCREEN
-                return w, h
-            except Exception:
-                # Способ 3: значения по умолчанию
-                print("Server2: Используются значения разрешения по умолчанию 1920x1080")
-                return 1920, 1080
-
-    async def get_data(self):
-        uptime = int(time.time() - self.start_time)
-        w, h = await self.get_screen_size()
-        return {"uptime_seconds": uptime, "screen_width": w, "screen_height": h, "ts": int(time.time())}
+        return await self.screen.get()
 
     async def start_monitor(self):
-        while True:
-            data = await self.get_data()
-            data_for_comparison = {k: v for k, v in data.items() if k != "ts"}
-            current_for_comparison = {k: v for k, v in (self.current or {}).items() if k != "ts"}
-            
-            async with self.lock:
-                changed = (current_for_comparison != data_for_comparison)
-                self.current = data
-            
-            if changed:
-                await self.notify_subscribers(data)
-                send_log(SERVER_NAME, "INFO", f"Data changed: {data}")
-            
-            await asyncio.sleep(1)
-
-    async def notify_subscribers(self, data):
-        dead = []
-        for w in list(self.subscribers):
-            try:
-                w.write((json.dumps({"type":"DATA","payload":data}) + "\n").encode("utf-8"))
-                await w.drain()
-            except Exception:
-                dead.append(w)
-        for w in dead:
-            self.subscribers.discard(w)
-
-    async def handle_client(self, reader, writer):
-        addr = writer.get_extra_info('peername')
-        client_id = self.client_count + 1
-        self.client_count += 1
-        
-        # ВЫВОД В КОНСОЛЬ СЕРВЕРА
-        print(f"Server2: Клиент #{client_id} подключился с {addr}")
-        send_log(SERVER_NAME, "INFO", f"Client connected {addr}")
-        
-        self.clients_last[writer] = None
-        
+        # SIGHUP — экран сменился (xrandr, подключение монитора): перечитать разрешение сразу
         try:
-            while True:
-                line = await reader.readline()
-                if not line:
-                    break
-                
-                try:
-                    msg = json.loads(line.decode("utf-8").strip())
-                except Exception:
-                    continue
-                
-                t = msg.get("type")
-                if t == "POLL":
-                    async with self.lock:
-                        cur = self.current
-                        last = self.clients_last.get(writer)
-                        if cur is not None and cur != last:
-                            writer.write((json.dumps({"type":"DATA","payload":cur}) + "\n").encode("utf-8"))
-                            await writer.drain()
-                            self.clients_last[writer] = cur
-                            
-                elif t == "REGISTER":
-                    self.subscribers.add(writer)
-                    writer.write((json.dumps({"type":"ACK","message":"REGISTERED"}) + "\n").encode("utf-8"))
-                    await writer.drain()
-                    print(f"Server2: Клиент #{client_id} подписался на push-уведомления")
-                    
-                elif t == "UNREGISTER":
-                    self.subscribers.discard(writer)
-                    writer.write((json.dumps({"type":"ACK","message":"UNREGISTERED"}) + "\n").encode("utf-8"))
-                    await writer.drain()
-                    print(f"Server2: Клиент #{client_id} отписался от push-уведомлений")
-                    
-                else:
-                    writer.write((json.dumps({"type":"ACK","message":"UNKNOWN"}) + "\n").encode("utf-8"))
-                    await writer.drain()
-                    
-        except Exception as e:
-            print(f"Server2: Ошибка с клиентом #{client_id}: {e}")
-            
-        finally:
-            # ВЫВОД В КОНСОЛЬ ПРИ ОТКЛЮЧЕНИИ
-            print(f"Server2: Клиент #{client_id} отключился")
-            send_log(SERVER_NAME, "INFO", f"Client disconnected {addr}")
-            self.subscribers.discard(writer)
-            self.clients_last.pop(writer, None)
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except Exception:
-                pass
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, self._screen_changed)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            # Windows или не главный поток — остаётся опрос раз в SCREEN_REPROBE_INTERVAL
+            pass
+        await super().start_monitor()
+
+    def _screen_changed(self):
+        print("Server2: SIGHUP — повторный опрос разрешения экрана")
+        self.screen.invalidate()
+        self.request_sample()
+
+    async def prepare_sample(self):
+        # обновление кэша разрешения (при необходимости — опрос в отдельном потоке)
+        await self.screen.get()
+
+    def sample(self):
+        uptime = int(time.time() - self.start_time)
+        w, h = self.screen.size or self.screen.default
+        return uptime, w, h
 
 async def main():
     s = Server2()
     asyncio.create_task(s.start_monitor())
     srv = await asyncio.start_server(s.handle_client, HOST, PORT)
+    if METRICS_PORT:
+        await serve_metrics_http(s, HOST, METRICS_PORT)
+        print(f"Метрики: http://{HOST}:{METRICS_PORT}/metrics")
     
     print(f"Server2 запущен на {HOST}:{PORT}")
     print("Ожидание подключений клиентов...")
@@ -154,4 +168,5 @@ async def main():
         await srv.serve_forever()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if not run_workers(Server2, HOST, PORT, WORKERS, METRICS_PORT):
+        run_server(main)
\ No newline at end of file
@@ -1,26 +1,583 @@
-# Общие вспомогательные функции для серверов — отправка логов на централизованный LogServer.
-# Пояснение: используем простое TCP-соединение для посылки одной JSON-строки.
+# Общие вспомогательные функции для серверов — отправка логов на централизованный LogServer
+# и общий протокол клиентов (MonitorServer), одинаковый для Server1 и Server2.
+# Пояснение: send_log только кладёт запись в ограниченную очередь в памяти, а фоновый поток
+# собирает записи в пачки (по размеру или по времени) и отправляет их по одному keep-alive
+# HTTP-соединению. Поэтому вызов send_log из корутин не блокирует цикл событий.
+# Если LogServer принимает TCP-поток (LOG_STREAM_PORT), пачки пишутся в одно долгоживущее
+# соединение строками NDJSON без ожидания ответа на каждую; сервер присылает кумулятивные
+# подтверждения, а неподтверждённые пачки при обрыве отправляются заново (возможны дубли, но
+# не потери). Без потока — прежняя отправка по HTTP.
 import os
 import sys
 import json
 import time
-import urllib.request
+import atexit
+import socket
+import ipaddress
+import asyncio
+import threading
+import collections
+import http.client
+
+from fanout import FanOut, Update, SubscriptionFilter
+from codec import Connection, WireStats, server_hello
+from metrics import ServerMetrics, LoopLagProbe
+import history
+from history import History
+import sampler
+from sampler import SamplingScheduler, ChangeDetector
+from profiling import Profiler, LagWatchdog, PROFILE_SECONDS, PROFILE_TOP
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(BASE)
 sys.path.insert(0, BASE)
 
-# адрес логсервера по умолчанию (localhost). 
+# адрес логсервера по умолчанию (localhost).
 LOGGING_SERVER = ("127.0.0.1", 8888)
 
+# Параметры фоновой отправки логов
+LOG_QUEUE_MAX = 10000              # максимум записей, ожидающих отправки
+LOG_BATCH_SIZE = 200               # записей в одной пачке
+LOG_FLUSH_INTERVAL = 0.5           # максимум секунд, которое запись ждёт в очереди
+LOG_OVERFLOW_POLICY = "drop_oldest"  # drop_oldest | drop_newest — что выбрасывать при переполнении
+LOG_SEND_TIMEOUT = 2
+LOG_TRANSPORT = "auto"             # auto — TCP-поток, если LogServer его принимает, иначе HTTP | http
+LOG_STREAM_PORT = 8889
+LOG_STREAM_WINDOW = 64             # неподтверждённых пачек, после которых ждём подтверждения
+LOG_STREAM_RETRY = 30.0            # через сколько секунд снова пробовать поток после ошибки
+
+# json.dumps с ensure_ascii=False каждый раз создаёт новый кодировщик — держим один
+_LOG_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+# Каждая KEYFRAME_EVERY-я версия рассылается полным кадром DATA даже подписчикам с дельтами
+KEYFRAME_EVERY = 30
+
+# Команда PROFILE принимается только с этих адресов
+ADMIN_HOSTS = ("127.0.0.1", "::1")
+
+# Подробный вывод в консоль (каждая рассылка и т.п.). В обычной работе выключен.
+DEBUG = False
+
+
+def is_admin_host(host):
+    # на двухстековом сокете локальный IPv4-клиент виден как ::ffff:127.0.0.1
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return str(getattr(addr, "ipv4_mapped", None) or addr) in ADMIN_HOSTS
+
+
+def debug(message):
+    if DEBUG:
+        print(message)
+
+
+class LogShipper:
+    """Асинхронная отправка логов: очередь + фоновый поток, который шлёт записи пачками."""
+
+    def __init__(self, address=LOGGING_SERVER, queue_max=LOG_QUEUE_MAX, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, overflow=LOG_OVERFLOW_POLICY, timeout=LOG_SEND_TIMEOUT,
+                 transport=LOG_TRANSPORT, stream_port=LOG_STREAM_PORT):
+        if overflow not in ("drop_oldest", "drop_newest"):
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        if transport not in ("auto", "http"):
+            raise ValueError(f"Неизвестный способ отправки логов: {transport}")
+        self.address = address
+        self.transport = transport
+        self.stream_address = (address[0], stream_port)
+        self.queue_max = max(1, int(queue_max))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.overflow = overflow
+        self.timeout = timeout
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self._conn = None
+        self._batch_supported = True
+        # TCP-поток: сокет, неподтверждённые пачки [номер последней строки, записи, байты]
+        self._sock = None
+        self._rbuf = b""
+        self._stream_seq = 0
+        self._unacked = collections.deque()
+        self._stream_retry_at = 0.0
+
+    def enqueue(self, record):
+        # Горячий путь: без ввода-вывода, только добавление в очередь под блокировкой
+        with self.cond:
+            if self._closed:
+                self.dropped += 1
+                return
+            if len(self.queue) >= self.queue_max:
+                self.dropped += 1
+                if self.overflow == "drop_newest":
+                    return
+                self.queue.popleft()
+            self.queue.append(record)
+            if len(self.queue) == 1 or len(self.queue) == self.batch_size:
+                self.cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-shipper", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=LOG_SEND_TIMEOUT):
+        """Отправляет всё накопленное и ждёт опустошения очереди (не дольше timeout)."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            if self._thread is None:
+                return not self.queue
+            self._flush_requested = True
+            self.cond.notify_all()
+            while self.queue or self._in_flight or self._unacked:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            return True
+
+    def close(self, timeout=LOG_SEND_TIMEOUT):
+        """Сбрасывает очередь и останавливает фоновый поток."""
+        self.flush(timeout)
+        with self.cond:
+            self._closed = True
+            self.cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _take_batch(self):
+        with self.cond:
+            while not self.queue and not self._closed:
+                if self._flush_requested and self._unacked:
+                    # пустая пачка — _run дождётся подтверждения отправленного по потоку
+                    return []
+                self._flush_requested = False
+                self.cond.notify_all()
+                self.cond.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while len(self.queue) < self.batch_size and not self._closed and not self._flush_requested:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            n = min(self.batch_size, len(self.queue))
+            batch = [self.queue.popleft() for _ in range(n)]
+            self._in_flight = n
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                ok = self._deliver(batch)
+            elif self._unacked:
+                self._settle()
+            with self.cond:
+                if batch:
+                    if ok:
+                        self.sent += len(batch)
+                    else:
+                        self.failed += len(batch)
+                self._in_flight = 0
+                self.cond.notify_all()
+                if self._closed and not self.queue:
+                    break
+        self._close_conn()
+        self._close_stream()
+
+    def _deliver(self, batch):
+        if self.transport != "http" and time.monotonic() >= self._stream_retry_at:
+            encode = _LOG_ENCODER.encode
+            self._unacked.append([0, batch, "".join([encode(r) + "\n" for r in batch]).encode("utf-8")])
+            try:
+                if self._sock is None:
+                    # отправляет и все неподтверждённые пачки, включая эту
+                    self._open_stream()
+                else:
+                    self._send_entry(self._unacked[-1])
+                self._read_acks(LOG_STREAM_WINDOW)
+                return True
+            except (OSError, ValueError):
+                return self._stream_failed()
+        return self._deliver_http(batch)
+
+    def _open_stream(self):
+        sock = socket.create_connection(self.stream_address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._rbuf = b""
+        # номера строк в подтверждениях считаются заново для каждого соединения
+        self._stream_seq = 0
+        for entry in self._unacked:
+            self._send_entry(entry)
+
+    def _send_entry(self, entry):
+        # sendall блокируется, пока LogServer не освободит окно TCP, — это и есть обратное давление
+        self._sock.settimeout(self.timeout)
+        self._sock.sendall(entry[2])
+        self._stream_seq += len(entry[1])
+        entry[0] = self._stream_seq
+
+    def _read_acks(self, window):
+        """Разбирает пришедшие {"ack": N}; ждёт, пока неподтверждённых пачек больше window."""
+        while self._unacked:
+            block = len(self._unacked) > window
+            self._sock.settimeout(self.timeout if block else 0.0)
+            try:
+                chunk = self._sock.recv(4096)
+            except BlockingIOError:
+                return
+            if not chunk:
+                raise ConnectionError("LogServer закрыл поток")
+            *lines, self._rbuf = (self._rbuf + chunk).split(b"\n")
+            for line in lines:
+                ack = json.loads(line).get("ack", 0)
+                while self._unacked and self._unacked[0][0] <= ack:
+                    self._unacked.popleft()
+
+    def _settle(self):
+        try:
+            if self._sock is None:
+                self._open_stream()
+            self._read_acks(0)
+        except (OSError, ValueError):
+            self._stream_failed()
+
+    def _stream_failed(self):
+        # поток недоступен: неподтверждённое уходит по HTTP, поток пробуем снова через LOG_STREAM_RETRY
+        self._close_stream()
+        self._stream_retry_at = time.monotonic() + LOG_STREAM_RETRY
+        ok = True
+        while self._unacked:
+            ok = self._deliver_http(self._unacked.popleft()[1]) and ok
+        return ok
+
+    def _close_stream(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _deliver_http(self, batch):
+        # Одна повторная попытка: keep-alive соединение могло быть закрыто сервером
+        for _ in range(2):
+            try:
+                if self._batch_supported:
+                    body = "\n".join([_LOG_ENCODER.encode(r) for r in batch]).encode("utf-8")
+                    status = self._post("/log/batch", body, "application/x-ndjson")
+                    if status == 404:
+                        # старый LogServer без пакетного приёма — шлём по одной записи
+                        self._batch_supported = False
+                    else:
+                        return status == 200
+                for r in batch:
+                    self._post("/log", json.dumps(r).encode("utf-8"), "application/json")
+                return True
+            except Exception:
+                self._close_conn()
+        return False
+
+    def _post(self, path, body, content_type):
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.address[0], self.address[1], timeout=self.timeout)
+        self._conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+        resp = self._conn.getresponse()
+        resp.read()
+        if resp.will_close:
+            self._close_conn()
+        return resp.status
+
+    def _close_conn(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+
+_shipper = LogShipper()
+atexit.register(_shipper.close)
+
+
 def send_log(sender, level, message):
+    # логирование ошибок логирования не критично — при переполнении запись просто отбрасывается
+    _shipper.enqueue({"sender": sender, "level": level, "message": str(message), "ts": time.time()})
+
+
+def configure_log_shipper(**kwargs):
+    """Пересоздаёт фоновый отправитель логов с новыми параметрами (см. LogShipper)."""
+    global _shipper
+    old = _shipper
+    _shipper = LogShipper(**kwargs)
+    atexit.register(_shipper.close)
+    old.close()
+    return _shipper
+
+
+def flush_logs(timeout=LOG_SEND_TIMEOUT):
+    return _shipper.flush(timeout)
+
+
+def run_server(main):
+    """Запускает корутину сервера; при остановке (Ctrl+C, SIGTERM) сбрасывает очередь логов."""
+    import signal
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    except (ValueError, AttributeError):
+        pass
     try:
-        data = {"sender": sender, "level": level, "message": str(message), "ts": time.time()}
-        url = f"http://{LOGGING_SERVER[0]}:{LOGGING_SERVER[1]}/log"
-        req = urllib.request.Request(url, data=json.dumps(data).encode('utf-8'),
-                                     headers={'Content-Type': 'application/json'})
-        urllib.request.urlopen(req, timeout=2)
-    except Exception:
-        # логирование ошибок логирования не критично — игнорируем
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
         pass
+    finally:
+        _shipper.close()
+
+
+class MonitorServer:
+    """Общий протокол Server1/Server2: опрос, подписка на push и версия текущих данных.
+
+    Подкласс задаёт NAME (для консоли), SERVER_NAME (отправитель логов), FIELDS и sample() —
+    блокирующую функцию, которая возвращает кортеж значений полей FIELDS (без ts).
+    """
+    NAME = "Server"
+    SERVER_NAME = "server"
+    FIELDS = ()
+    SCHEMA = None     # схема двоичного формата из codec.SCHEMAS
+    MIN_INTERVAL = sampler.MIN_INTERVAL
+    MAX_INTERVAL = sampler.MAX_INTERVAL
+    HISTORY_SIZE = history.HISTORY_SIZE
+    # значимость изменений (sampler.ChangeDetector): поле -> порог (число или "N%"),
+    # минимум секунд между публикациями и принудительная публикация после молчания
+    SIGNIFICANCE = {}
+    HOLD_TIME = sampler.HOLD_TIME
+    MAX_SILENCE = sampler.MAX_SILENCE
+
+    def __init__(self):
+        # writer -> версия данных, последней отправленной этому клиенту
+        self.clients_last = {}
+        self.fanout = FanOut(self.NAME)
+        self.current = None
+        # версия растёт на 1 при каждом изменении self.current
+        self.version = 0
+        self.current_update = None
+        self.client_count = 0
+        # счётчики zlib-сжатия по всем соединениям: сколько байт сэкономлено и ценой какого CPU
+        self.compression = WireStats()
+        self.metrics = ServerMetrics()
+        # кольцевой буфер прошлых версий данных для запросов HISTORY (HISTORY_SIZE = 0 — без истории)
+        self.history = History(self.FIELDS, self.SCHEMA, self.HISTORY_SIZE) if self.HISTORY_SIZE else None
+        self.detector = ChangeDetector(self.FIELDS, self.SIGNIFICANCE, self.HOLD_TIME, self.MAX_SILENCE)
+        self.scheduler = SamplingScheduler(self.sample, self._on_change, prepare=self.prepare_sample,
+                                           min_interval=self.MIN_INTERVAL, max_interval=self.MAX_INTERVAL,
+                                           observe=self.metrics.sample_seconds.observe,
+                                           detector=self.detector)
+        self._lag_probe = None
+        self.profiler = Profiler(self.SERVER_NAME)
+        self.watchdog = LagWatchdog(self.SERVER_NAME)
+        # в многопроцессном режиме (workers.py) опрос идёт в отдельном процессе:
+        # remote_trigger() просит его об внеочередном опросе вместо локального планировщика
+        self.remote_trigger = None
+
+    def sample(self):
+        raise NotImplementedError
+
+    async def prepare_sample(self):
+        # подкласс может обновить здесь асинхронные кэши перед опросом в пуле потоков
+        pass
+
+    def start_probes(self):
+        """Гистограмма задержки цикла событий, сторож зависаний и сигналы профилирования."""
+        loop = asyncio.get_running_loop()
+        self._lag_probe = asyncio.ensure_future(LoopLagProbe(histogram=self.metrics.loop_lag_seconds).run())
+        self.watchdog.start(loop)
+        import signal
+        for sig, mode in (("SIGUSR1", "cpu"), ("SIGUSR2", "mem")):
+            try:
+                loop.add_signal_handler(getattr(signal, sig), self._profile_signal, mode)
+            except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+                # Windows или не главный поток — остаётся команда PROFILE
+                pass
+
+    def _profile_signal(self, mode):
+        try:
+            self.profiler.start(mode)
+        except (RuntimeError, ValueError) as e:
+            print(f"{self.NAME}: {e}")
+
+    async def start_monitor(self):
+        self.start_probes()
+        await self.scheduler.run()
+
+    async def _on_change(self, values):
+        data = dict(zip(self.FIELDS, values))
+        # ts с точностью до миллисекунд — по нему считается задержка доставки push
+        data["ts"] = round(time.time(), 3)
+        self._new_version(data)
+        await self.notify_subscribers(data)
+        send_log(self.SERVER_NAME, "INFO", f"Data changed: {data}")
+
+    def _new_version(self, data):
+        self._set_version(self.version + 1, data)
+
+    def _set_version(self, version, data):
+        prev = self.current_update
+        changes = None
+        # дельта возможна только относительно непосредственно предыдущей версии
+        if prev is not None and version == prev.version + 1 and version % KEYFRAME_EVERY != 0:
+            changes = {k: v for k, v in data.items() if prev.payload.get(k) != v}
+        self.version = version
+        self.current = data
+        self.current_update = Update(version, data, changes, version - 1)
+        if self.history is not None:
+            self.history.append_payload(data)
+
+    def accept_snapshot(self, version, data):
+        """Данные от общего процесса опроса (многопроцессный режим). True — если это новая версия."""
+        if version == self.version:
+            return False
+        self._set_version(version, data)
+        return True
+
+    def request_sample(self):
+        if self.remote_trigger is not None:
+            self.remote_trigger()
+        else:
+            self.scheduler.trigger()
+
+    async def notify_subscribers(self, data):
+        # кадр кодируется один раз, дальше его отправляют задачи-писатели подписчиков
+        t0 = time.perf_counter()
+        self.fanout.publish(self.current_update)
+        self.metrics.fanout_seconds.observe(time.perf_counter() - t0)
+        if DEBUG and len(self.fanout):
+            debug(f"{self.NAME}: Данные разосланы подписчикам: {len(self.fanout)}")
+
+    def handle_command(self, conn, msg, client_id):
+        """Одна команда клиента. Ответ только записывается в буфер; drain делает handle_client."""
+        writer = conn.writer
+        t = msg.get("type")
+        if t == "HELLO":
+            # ответ уходит ещё в старом формате, дальше — в согласованном
+            try:
+                reply, codec, compress = server_hello(msg, self.SCHEMA)
+            except ValueError as e:
+                conn.write({"type": "ACK", "message": "BAD_REQUEST", "error": str(e)})
+                return
+            conn.write(reply)
+            conn.switch(codec, compress)
+
+        elif t == "POLL":
+            # условный опрос: клиент присылает последнюю известную ему версию
+            known = msg.get("version", self.clients_last.get(writer, 0))
+            if self.current_update is None or known == self.version:
+                conn.write({"type": "NOT_MODIFIED", "version": self.version})
+            else:
+                conn.write_frame(self.current_update.frame_for(known, bool(msg.get("delta")), conn.codec))
+                self.clients_last[writer] = self.version
+
+        elif t == "REGISTER":
+            # delta=true — клиент умеет применять кадры DELTA;
+            # fields / min_interval / thresholds — необязательные условия подписки
+            try:
+                flt = SubscriptionFilter.from_message(msg, self.FIELDS)
+            except (TypeError, ValueError) as e:
+                conn.write({"type": "ACK", "message": "BAD_REQUEST", "error": str(e)})
+                return
+            sub = self.fanout.add(conn, delta=bool(msg.get("delta")), filter=flt)
+            # ОТПРАВЛЯЕМ ДАННЫЕ СРАЗУ ПРИ ПОДПИСКЕ — первым кадром, до ACK
+            if self.current_update is not None:
+                sub.send_snapshot(self.current_update)
+                self.clients_last[writer] = self.version
+            conn.write({"type": "ACK", "message": "REGISTERED"})
+            # новый подписчик — сразу проверяем, не устарели ли данные
+            self.request_sample()
+            print(f"{self.NAME}: Клиент #{client_id} подписался на push-уведомления")
+
+        elif t == "HISTORY" and self.history is not None:
+            # {"type":"HISTORY","from":ts,"to":ts,"bucket":сек,"fields":[...]} -> min/max/mean по корзинам
+            try:
+                result = self.history.query(msg.get("from"), msg.get("to"),
+                                            msg.get("bucket"), msg.get("fields"))
+            except (TypeError, ValueError) as e:
+                conn.write({"type": "ACK", "message": "BAD_REQUEST", "error": str(e)})
+            else:
+                conn.write({"type": "HISTORY", **result})
+
+        elif t == "METRICS":
+            # служебный запрос: снимок счётчиков и гистограмм
+            conn.write({"type": "METRICS", "metrics": self.metrics.snapshot(self)})
+
+        elif t == "PROFILE":
+            # {"type":"PROFILE","mode":"cpu"|"mem","seconds":10,"top":40} — отчёт в logs/profiles/
+            if not is_admin_host((writer.get_extra_info("peername") or ("",))[0]):
+                conn.write({"type": "ACK", "message": "FORBIDDEN"})
+                return
+            try:
+                path = self.profiler.start(msg.get("mode", "cpu"), msg.get("seconds", PROFILE_SECONDS),
+                                           msg.get("top", PROFILE_TOP))
+            except (TypeError, ValueError, RuntimeError) as e:
+                conn.write({"type": "ACK", "message": "BAD_REQUEST", "error": str(e)})
+            else:
+                conn.write({"type": "ACK", "message": "PROFILING", "path": path})
+
+        elif t == "UNREGISTER":
+            self.fanout.remove(writer)
+            conn.write({"type": "ACK", "message": "UNREGISTERED"})
+            print(f"{self.NAME}: Клиент #{client_id} отписался от push-уведомлений")
+
+        else:
+            conn.write({"type": "ACK", "message": "UNKNOWN"})
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        client_id = self.client_count + 1
+        self.client_count += 1
+
+        print(f"{self.NAME}: Клиент #{client_id} подключился с {addr}")
+        send_log(self.SERVER_NAME, "INFO", f"Client connected {addr}")
+
+        self.clients_last[writer] = 0
+        conn = Connection(reader, writer, stats=self.compression, metrics=self.metrics)
+
+        try:
+            while True:
+                # все команды, уже пришедшие от клиента (в том числе JSON-массивом), обрабатываются
+                # подряд, а ответы уходят одной записью с одним drain
+                batch = await conn.recv_batch()
+                if not batch:
+                    break
+                conn.cork()
+                try:
+                    for msg in batch:
+                        self.handle_command(conn, msg, client_id)
+                finally:
+                    conn.uncork()
+                await writer.drain()
+
+        except Exception as e:
+            print(f"{self.NAME}: Ошибка с клиентом #{client_id}: {e}")
 
+        finally:
+            print(f"{self.NAME}: Клиент #{client_id} отключился")
+            if conn.compressor is not None:
+                st = conn.own_stats
+                print(f"{self.NAME}: Клиент #{client_id}: сжатие {st.raw_bytes} -> {st.wire_bytes} байт, "
+                      f"сэкономлено {st.saved}, CPU {st.compress_time * 1e3:.1f} мс")
+            send_log(self.SERVER_NAME, "INFO", f"Client disconnected {addr}")
+            self.fanout.remove(writer)
+            self.clients_last.pop(writer, None)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
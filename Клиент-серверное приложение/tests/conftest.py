@@ -0,0 +1,5 @@
+# Тесты запускаются из каталога проекта: python -m pytest -q tests
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
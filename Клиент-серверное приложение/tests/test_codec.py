@@ -0,0 +1,157 @@
+import asyncio
+import tracemalloc
+import zlib
+
+import pytest
+
+from codec import (JSON, MAX_FRAME, Connection, ProtocolError, make_codec, server_hello)
+
+
+class FakeWriter:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+
+    def is_closing(self):
+        return False
+
+
+def decode_all(codec, data):
+    dec = codec.decoder()
+    dec.feed(data)
+    out = []
+    while True:
+        msg = dec.next_message()
+        if msg is None:
+            return out
+        out.append(msg)
+
+
+MESSAGES = [
+    {"type": "DATA", "version": 7, "payload": {"swap_total": 100, "swap_free": 40, "ts": 1.5}},
+    {"type": "DELTA", "version": 8, "base": 7, "changes": {"swap_free": 30, "ts": 2.5}},
+    {"type": "NOT_MODIFIED", "version": 8},
+    {"type": "POLL", "version": 8, "delta": True},
+    {"type": "ACK", "message": "REGISTERED"},
+]
+
+
+@pytest.mark.parametrize("fmt", ["json", "bin"])
+def test_round_trip(fmt):
+    codec = make_codec(fmt, "swap")
+    data = b"".join(codec.encode(m) for m in MESSAGES)
+    assert decode_all(codec, data) == MESSAGES
+
+
+def test_binary_is_smaller_than_json():
+    codec = make_codec("bin", "swap")
+    assert len(codec.encode(MESSAGES[0])) < len(JSON.encode(MESSAGES[0]))
+
+
+def test_partial_frames_wait_for_the_rest():
+    codec = make_codec("bin", "swap")
+    frame = codec.encode(MESSAGES[0])
+    dec = codec.decoder()
+    dec.feed(frame[:5])
+    assert dec.next_message() is None
+    dec.feed(frame[5:])
+    assert dec.next_message() == MESSAGES[0]
+
+
+def test_oversized_binary_frame_is_rejected():
+    dec = make_codec("bin", "swap").decoder()
+    dec.feed((MAX_FRAME + 1).to_bytes(4, "big") + b"\x00")
+    with pytest.raises(ProtocolError):
+        dec.next_message()
+
+
+def test_oversized_json_line_is_rejected():
+    dec = JSON.decoder()
+    dec.feed(b"x" * (MAX_FRAME + 1))
+    with pytest.raises(ProtocolError):
+        dec.next_message()
+
+
+def make_reader(chunks):
+    reader = asyncio.StreamReader()
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+async def receive_all(conn):
+    out = []
+    while True:
+        msg = await conn.recv()
+        if msg is None:
+            return out
+        out.append(msg)
+
+
+@pytest.mark.parametrize("fmt", ["json", "bin"])
+def test_zlib_connection_round_trip(fmt):
+    async def run():
+        codec = make_codec(fmt, "swap")
+        sender = Connection(None, FakeWriter())
+        sender.switch(codec, "zlib")
+        for m in MESSAGES:
+            sender.write(m)
+        wire = bytes(sender.writer.buf)
+        receiver = Connection(make_reader([wire[i:i + 7] for i in range(0, len(wire), 7)]), FakeWriter())
+        receiver.switch(codec, "zlib")
+        return await receive_all(receiver)
+
+    assert asyncio.run(run()) == MESSAGES
+
+
+def test_zlib_many_frames_beyond_max_frame():
+    # суммарно больше MAX_FRAME, но каждый кадр маленький — разбирается целиком
+    async def run():
+        comp = zlib.compressobj()
+        msgs = [{"type": "POLL", "version": i, "pad": "x" * 1000} for i in range(2000)]
+        data = comp.compress(b"".join(JSON.encode(m) for m in msgs)) + comp.flush(zlib.Z_SYNC_FLUSH)
+        conn = Connection(make_reader([data]), FakeWriter())
+        conn.switch(JSON, "zlib")
+        return len(msgs), len(await receive_all(conn))
+
+    sent, received = asyncio.run(run())
+    assert sent == received
+
+
+@pytest.mark.parametrize("fmt", ["json", "bin"])
+def test_zlib_bomb_is_rejected(fmt):
+    # 64 МБ нулевой энтропии в нескольких КБ: распаковывается не больше одного кадра
+    async def run():
+        comp = zlib.compressobj(9)
+        head = b"" if fmt == "json" else (MAX_FRAME - 1).to_bytes(4, "big") + b"\x00"
+        bomb = comp.compress(head) + b"".join(comp.compress(b"a" * (1 << 20)) for _ in range(64))
+        bomb += comp.flush(zlib.Z_SYNC_FLUSH)
+        assert len(bomb) < 200 * 1024
+        conn = Connection(make_reader([bomb]), FakeWriter())
+        conn.switch(make_codec(fmt, "swap"), "zlib")
+        await conn.recv()
+
+    tracemalloc.start()
+    try:
+        with pytest.raises(ProtocolError):
+            asyncio.run(run())
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 8 * MAX_FRAME
+
+
+def test_server_hello_picks_first_supported_format():
+    reply, codec, compress = server_hello({"formats": ["cbor", "bin", "json"], "compress": ["zlib"]}, "swap")
+    assert reply["format"] == "bin" and codec.name == "bin:swap" and compress == "zlib"
+    reply, codec, compress = server_hello({"formats": ["bin"]}, None)
+    assert reply["format"] == "json" and codec is JSON and compress is None
+
+
+@pytest.mark.parametrize("msg", [{"formats": "bin"}, {"formats": 1}, {"compress": "zlib"}])
+def test_server_hello_rejects_non_lists(msg):
+    with pytest.raises(ValueError):
+        server_hello(msg, "swap")
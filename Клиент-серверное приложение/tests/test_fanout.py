@@ -0,0 +1,62 @@
+import pytest
+
+from fanout import SubscriptionFilter, Update
+
+FIELDS = ("swap_total", "swap_free")
+
+
+def test_no_conditions_means_no_filter():
+    assert SubscriptionFilter.from_message({"type": "REGISTER", "delta": True}, FIELDS) is None
+
+
+def test_conditions_are_parsed():
+    f = SubscriptionFilter.from_message({"fields": ["swap_free", "swap_free"], "min_interval": 5,
+                                         "thresholds": {"swap_free": "10%", "swap_total": 1024}}, FIELDS)
+    assert f.fields == ("swap_free",)
+    assert f.min_interval == 5.0
+    assert f.thresholds == {"swap_free": (0.0, 0.1), "swap_total": (1024.0, 0.0)}
+
+
+@pytest.mark.parametrize("msg", [
+    {"fields": []},
+    {"fields": "swap_free"},
+    {"fields": ["uptime_seconds"]},
+    {"min_interval": -1},
+    {"min_interval": "5"},
+    {"thresholds": ["swap_free"]},
+    {"thresholds": {"nope": 1}},
+    {"thresholds": {"swap_free": "much"}},
+    {"thresholds": {"swap_free": True}},
+])
+def test_bad_conditions(msg):
+    with pytest.raises(ValueError):
+        SubscriptionFilter.from_message(msg, FIELDS)
+
+
+def update(version, swap_free, swap_total=1000):
+    return Update(version, {"swap_total": swap_total, "swap_free": swap_free, "ts": float(version)})
+
+
+def test_threshold_is_measured_from_last_sent():
+    f = SubscriptionFilter.from_message({"thresholds": {"swap_free": 100}, "fields": ["swap_free"]}, FIELDS)
+    sent = update(1, 500)
+    assert f.passes(sent, None)
+    assert not f.passes(update(2, 560), sent)
+    assert not f.passes(update(3, 599), sent)
+    assert f.passes(update(4, 600), sent)
+
+
+def test_field_without_threshold_passes_on_any_change():
+    f = SubscriptionFilter.from_message({"thresholds": {"swap_free": "50%"}}, FIELDS)
+    sent = update(1, 500)
+    assert not f.passes(update(2, 510), sent)
+    assert f.passes(update(3, 510, swap_total=1001), sent)
+
+
+def test_filtered_frame_carries_only_chosen_fields():
+    from codec import JSON
+    frame = update(1, 500).full(JSON, ("swap_free",))
+    assert JSON.decoder().feed(frame) is None
+    dec = JSON.decoder()
+    dec.feed(frame)
+    assert dec.next_message()["payload"] == {"swap_free": 500, "ts": 1.0}
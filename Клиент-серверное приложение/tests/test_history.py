@@ -0,0 +1,58 @@
+import pytest
+
+from history import History
+
+
+@pytest.fixture
+def history():
+    h = History(("uptime_seconds", "screen_width"), "screen", size=100)
+    for i in range(60):
+        h.append(1000.0 + i, [i, 800 + (i % 2)])
+    return h
+
+
+def test_buckets(history):
+    r = history.query(1000, 1060, 10)
+    assert r["ts"] == [1000, 1010, 1020, 1030, 1040, 1050]
+    assert r["count"] == [10] * 6
+    assert r["min"]["uptime_seconds"][0] == 0 and r["max"]["uptime_seconds"][0] == 9
+    assert r["mean"]["uptime_seconds"][0] == pytest.approx(4.5)
+    assert r["min"]["screen_width"][0] == 800 and r["max"]["screen_width"][0] == 801
+
+
+def test_empty_buckets_are_skipped():
+    h = History(("uptime_seconds",), "screen", size=10)
+    h.append(0.0, [1])
+    h.append(35.0, [2])
+    r = h.query(0, 40, 10)
+    assert r["ts"] == [0, 30] and r["count"] == [1, 1]
+
+
+def test_ring_keeps_last_size_records():
+    h = History(("uptime_seconds",), "screen", size=10)
+    for i in range(25):
+        h.append(float(i), [i])
+    r = h.query(0, 100, 100)
+    assert r["count"] == [10] and r["min"]["uptime_seconds"] == [15]
+
+
+def test_field_subset(history):
+    r = history.query(1000, 1060, 60, ["screen_width"])
+    assert r["fields"] == ["screen_width"] and list(r["mean"]) == ["screen_width"]
+
+
+@pytest.mark.parametrize("bucket", [0, -5, float("nan")])
+def test_bad_bucket(history, bucket):
+    with pytest.raises(ValueError):
+        history.query(1000, 1060, bucket)
+
+
+@pytest.mark.parametrize("fields", ["uptime_seconds", ["nope"], [1], {"uptime_seconds": 1}])
+def test_bad_fields(history, fields):
+    with pytest.raises(ValueError):
+        history.query(1000, 1060, 10, fields)
+
+
+def test_empty_range(history):
+    with pytest.raises(ValueError):
+        history.query(1060, 1000, 10)
@@ -0,0 +1,116 @@
+import json
+import os
+import time
+
+import pytest
+
+from log_store import LOG_SUFFIX, LogStore, _reorder
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = LogStore(str(tmp_path / "store"), flush_policy="none", segment_age=0)
+    yield s
+    s.close()
+
+
+def records(sender, stamps, level="INFO"):
+    return [{"sender": sender, "level": level, "message": f"{sender}-{ts}", "ts": ts} for ts in stamps]
+
+
+def ts_of(lines):
+    return [json.loads(line)["ts"] for line in lines]
+
+
+def test_append_and_query_merges_senders_by_ts(store):
+    store.append_many("a", records("a", [1, 4, 5]))
+    store.append_many("b", records("b", [2, 3, 6]))
+    assert ts_of(store.query()) == [1, 2, 3, 4, 5, 6]
+    assert store.senders() == ["a", "b"]
+
+
+def test_query_filters(store):
+    store.append_many("a", records("a", [1, 2, 3]) + records("a", [4], level="ERROR"))
+    store.append_many("b", records("b", [5], level="error"))
+    assert ts_of(store.query(levels=["error"])) == [4, 5]
+    assert ts_of(store.query(senders=["a"], start=2, end=3)) == [2, 3]
+    assert ts_of(store.query(contains="b-5")) == [5]
+
+
+def test_query_limit(store):
+    store.append_many("a", records("a", range(100)))
+    assert ts_of(store.query(limit=5)) == [0, 1, 2, 3, 4]
+
+
+def test_out_of_order_arrivals_are_reordered(store):
+    store.append_many("a", records("a", [5, 1, 3, 2, 4]))
+    assert ts_of(store.query()) == [1, 2, 3, 4, 5]
+
+
+def test_reorder_window_is_bounded():
+    # запись, опоздавшая больше чем на window, выходит позже соседей — но память ограничена
+    items = [(ts, b"") for ts in [10, 11, 12, 13, 1]]
+    assert [ts for ts, _ in _reorder(items, window=2)] == [10, 11, 1, 12, 13]
+    assert [ts for ts, _ in _reorder(items, window=10)] == [1, 10, 11, 12, 13]
+
+
+def test_record_without_ts_gets_arrival_time(store):
+    before = time.time()
+    store.append({"sender": "a", "level": "INFO", "message": "x"})
+    (ts,) = ts_of(store.query())
+    assert before <= ts <= time.time()
+
+
+def test_unsafe_sender_names_stay_inside_store(store, tmp_path):
+    store.append({"sender": "../../etc/passwd", "level": "INFO", "message": "x", "ts": 1})
+    names = os.listdir(tmp_path / "store")
+    assert all(not n.startswith("..") for n in names)
+    assert ts_of(store.query()) == [1]
+
+
+def wait_compressed(store, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        segs = [seg for segs in store.segments().values() for seg in segs]
+        if segs and all(seg["file"].endswith(".gz") for seg in segs):
+            return segs
+        time.sleep(0.05)
+    raise AssertionError("сегменты не сжаты")
+
+
+def test_rotation_into_compressed_segments(tmp_path):
+    # ts тестовых записей — 1970 год: хранение по возрасту выключено, чтобы сегменты не удалялись
+    s = LogStore(str(tmp_path / "store"), flush_policy="none", segment_bytes=2048, segment_age=0,
+                 retention_age=0)
+    try:
+        for i in range(10):
+            s.append_many("a", records("a", range(i * 20, i * 20 + 20)))
+        segs = wait_compressed(s)
+        assert len(segs) >= 2
+        assert ts_of(s.query()) == list(range(200))
+        # сегменты вне диапазона не читаются, но результат тот же
+        assert ts_of(s.query(start=150, end=155)) == list(range(150, 156))
+    finally:
+        s.close()
+    # после перезапуска манифест и активный файл подхватываются
+    s = LogStore(str(tmp_path / "store"), flush_policy="none", segment_age=0, retention_age=0)
+    try:
+        assert ts_of(s.query(limit=3)) == [0, 1, 2]
+        assert len(list(s.query())) == 200
+    finally:
+        s.close()
+
+
+def test_query_does_not_adopt_foreign_or_unopened_files(tmp_path):
+    root = tmp_path / "store"
+    root.mkdir()
+    (root / "out.log").write_text("вывод процесса\n", encoding="utf-8")
+    (root / ("old" + LOG_SUFFIX)).write_text("".join(json.dumps({"ts": t}) + "\n" for t in (2, 1)))
+    s = LogStore(str(root), flush_policy="none", segment_age=0)
+    try:
+        assert s.senders() == ["old"]
+        assert ts_of(s.query()) == [1, 2]
+        assert sorted(os.listdir(root)) == ["old" + LOG_SUFFIX, "out.log", "segments"]
+        assert os.listdir(root / "segments") == []
+    finally:
+        s.close()
@@ -0,0 +1,86 @@
+# Живой MonitorServer на случайном порту: порядок кадров REGISTER и цепочка DELTA.
+import asyncio
+import json
+
+import pytest
+
+from codec import Connection, client_hello
+from server_base import MonitorServer
+
+
+class SwapServer(MonitorServer):
+    NAME = "TestServer"
+    SERVER_NAME = "test"
+    SCHEMA = "swap"
+    FIELDS = ("swap_total", "swap_free")
+    HISTORY_SIZE = 0
+
+    def sample(self):
+        raise AssertionError("в тесте данные публикуются вручную")
+
+
+async def start(server):
+    srv = await asyncio.start_server(server.handle_client, "127.0.0.1", 0)
+    return srv, srv.sockets[0].getsockname()[1]
+
+
+async def recv(conn):
+    return await asyncio.wait_for(conn.recv(), 5)
+
+
+@pytest.mark.parametrize("formats", [("json",), ("bin", "json")])
+def test_register_snapshot_then_ack_then_deltas(formats):
+    async def run():
+        s = SwapServer()
+        await s._on_change((1000, 500))
+        srv, port = await start(s)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        conn = Connection(reader, writer)
+        try:
+            if formats != ("json",):
+                assert (await client_hello(conn, formats)).name == "bin:swap"
+            await conn.send({"type": "REGISTER", "delta": True})
+            first = await recv(conn)
+            assert first["type"] == "DATA" and first["version"] == 1
+            assert first["payload"]["swap_free"] == 500
+            assert await recv(conn) == {"type": "ACK", "message": "REGISTERED"}
+
+            # между публикациями подписчик успевает отправить кадр, иначе версии схлопнутся в одну
+            await s._on_change((1000, 400))
+            d2 = await recv(conn)
+            await s._on_change((1000, 300))
+            d3 = await recv(conn)
+            assert (d2["type"], d2["version"], d2["base"]) == ("DELTA", 2, 1)
+            assert (d3["type"], d3["version"], d3["base"]) == ("DELTA", 3, 2)
+            assert d2["changes"]["swap_free"] == 400 and "swap_total" not in d2["changes"]
+
+            await conn.send({"type": "POLL", "version": 3})
+            assert await recv(conn) == {"type": "NOT_MODIFIED", "version": 3}
+        finally:
+            writer.close()
+            srv.close()
+            await srv.wait_closed()
+
+    asyncio.run(run())
+
+
+def test_batched_commands_answer_in_order():
+    async def run():
+        s = SwapServer()
+        await s._on_change((1000, 500))
+        srv, port = await start(s)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        conn = Connection(reader, writer)
+        try:
+            writer.write(json.dumps([{"type": "POLL", "version": 1}, {"type": "REGISTER", "fields": ["nope"]},
+                                     {"type": "POLL", "version": 0}]).encode() + b"\n")
+            replies = [await recv(conn) for _ in range(3)]
+            assert replies[0]["type"] == "NOT_MODIFIED"
+            assert replies[1]["message"] == "BAD_REQUEST"
+            assert replies[2]["type"] == "DATA" and replies[2]["version"] == 1
+        finally:
+            writer.close()
+            srv.close()
+            await srv.wait_closed()
+
+    asyncio.run(run())
@@ -0,0 +1,213 @@
+# Многопроцессный режим Server1/Server2: несколько процессов-обработчиков на одном порту.
+# Пояснение: каждый процесс-обработчик (worker) слушает тот же порт с SO_REUSEPORT, и ядро
+# распределяет новые соединения между ними, так что приём клиентов и кодирование кадров
+# идут на нескольких ядрах. Опрос данных (psutil, разрешение экрана) выполняет один общий
+# процесс опроса: он записывает последний снимок и его версию в общую память и будит
+# обработчики байтом в их pipe. Обработчики читают снимок и рассылают его своим подписчикам.
+# Версии общие для всех процессов, поэтому POLL с версией работает и после переподключения
+# к другому обработчику. Внеочередной опрос (новый подписчик) — байт в обратный pipe.
+# Где SO_REUSEPORT нет (Windows), run_workers возвращает False и сервер работает в одном процессе.
+# Метрики (GET /metrics) у каждого обработчика свои: порт metrics_port + номер обработчика.
+import os
+import sys
+import json
+import time
+import ctypes
+import socket
+import struct
+import signal
+import asyncio
+import multiprocessing
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE)
+sys.path.insert(0, BASE)
+
+from server_base import send_log, run_server
+from metrics import serve_metrics_http
+
+SNAPSHOT_SIZE = 4096      # байт общей памяти под снимок (JSON payload)
+WORKER_BACKLOG = 1024
+SNAPSHOT_READ_TIMEOUT = 0.05   # дольше запись снимка не длится; иначе писатель умер посреди записи
+
+# Заголовок снимка: счётчик seqlock (нечётный — идёт запись), версия, длина JSON
+SNAPSHOT_HEADER = struct.Struct("!QQI")
+SNAPSHOT_SEQ = struct.Struct("!Q")
+
+
+class SharedSnapshot:
+    """Последний снимок данных в общей памяти: один писатель (процесс опроса), много читателей."""
+
+    def __init__(self, buffer):
+        # buffer — multiprocessing.RawArray, переданный процессу при запуске
+        self.buffer = buffer
+        self.view = memoryview(buffer).cast("B")
+        # последний целиком прочитанный снимок
+        self.last = None
+
+    @classmethod
+    def create(cls, size=SNAPSHOT_SIZE):
+        return cls(multiprocessing.RawArray(ctypes.c_ubyte, size))
+
+    def write(self, version, payload):
+        body = json.dumps(payload).encode("utf-8")
+        if SNAPSHOT_HEADER.size + len(body) > len(self.view):
+            raise ValueError(f"снимок не помещается в общую память: {len(body)} байт")
+        seq = SNAPSHOT_SEQ.unpack_from(self.view)[0]
+        SNAPSHOT_SEQ.pack_into(self.view, 0, seq + 1)
+        self.view[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + len(body)] = body
+        SNAPSHOT_HEADER.pack_into(self.view, 0, seq + 1, version, len(body))
+        SNAPSHOT_SEQ.pack_into(self.view, 0, seq + 2)
+
+    def read(self, timeout=SNAPSHOT_READ_TIMEOUT):
+        """(версия, payload) или None, если снимка ещё нет. Если запись не завершается дольше
+        timeout (процесс опроса упал посреди записи), возвращается последний целый снимок."""
+        deadline = None
+        while True:
+            seq, version, length = SNAPSHOT_HEADER.unpack_from(self.view)
+            if not seq & 1:
+                body = bytes(self.view[SNAPSHOT_HEADER.size:SNAPSHOT_HEADER.size + length])
+                if SNAPSHOT_SEQ.unpack_from(self.view)[0] == seq:
+                    if not version:
+                        return None
+                    self.last = version, json.loads(body.decode("utf-8"))
+                    return self.last
+            # писатель в середине записи — пробуем чуть позже, но не бесконечно
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + timeout
+            elif now >= deadline:
+                print(f"Снимок в общей памяти не дописан дольше {timeout:g} с — используется последний целый")
+                return self.last
+            time.sleep(0)
+
+
+def _poke(pipe):
+    # неблокирующая запись: если pipe полон, получатель и так проснётся
+    try:
+        os.write(pipe.fileno(), b"\0")
+    except OSError:
+        pass
+
+
+def _drain(pipe):
+    try:
+        os.read(pipe.fileno(), 4096)
+    except OSError:
+        pass
+
+
+def _sampler_main(cls, buffer, wakes, trigger):
+    """Процесс опроса: единственный на хост вызов sample(); снимок — в общую память."""
+    snapshot = SharedSnapshot(buffer)
+    for pipe in wakes:
+        os.set_blocking(pipe.fileno(), False)
+    os.set_blocking(trigger.fileno(), False)
+
+    async def main():
+        s = cls()
+        on_change = s.scheduler.on_change
+
+        async def publish(values):
+            await on_change(values)
+            snapshot.write(s.version, s.current)
+            for pipe in wakes:
+                _poke(pipe)
+
+        def on_trigger():
+            _drain(trigger)
+            s.scheduler.trigger()
+
+        s.scheduler.on_change = publish
+        asyncio.get_running_loop().add_reader(trigger.fileno(), on_trigger)
+        print(f"{s.NAME}: процесс опроса запущен (pid {os.getpid()})")
+        await s.start_monitor()
+
+    run_server(main)
+
+
+async def follow_snapshot(server, snapshot, wake):
+    """Задача обработчика: по сигналу из pipe читает общий снимок и рассылает его подписчикам."""
+    loop = asyncio.get_running_loop()
+    event = asyncio.Event()
+
+    def on_wake():
+        _drain(wake)
+        event.set()
+
+    loop.add_reader(wake.fileno(), on_wake)
+    server.start_probes()
+    event.set()
+    while True:
+        await event.wait()
+        event.clear()
+        snap = snapshot.read()
+        if snap is not None and server.accept_snapshot(*snap):
+            await server.notify_subscribers(server.current)
+
+
+def _worker_main(cls, host, port, index, buffer, wake, trigger, metrics_port=None):
+    os.set_blocking(wake.fileno(), False)
+    os.set_blocking(trigger.fileno(), False)
+
+    async def main():
+        s = cls()
+        s.NAME = f"{s.NAME}[{index}]"
+        s.remote_trigger = lambda: _poke(trigger)
+        asyncio.create_task(follow_snapshot(s, SharedSnapshot(buffer), wake))
+        srv = await asyncio.start_server(s.handle_client, host, port, reuse_port=True, backlog=WORKER_BACKLOG)
+        print(f"{s.NAME} запущен на {host}:{port} (pid {os.getpid()})")
+        if metrics_port:
+            await serve_metrics_http(s, host, metrics_port + index)
+            print(f"{s.NAME}: метрики http://{host}:{metrics_port + index}/metrics")
+        async with srv:
+            await srv.serve_forever()
+
+    run_server(main)
+
+
+def reuse_port_supported():
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform != "win32"
+
+
+def run_workers(cls, host, port, workers, metrics_port=None):
+    """Запускает процесс опроса и workers обработчиков. False — если режим недоступен.
+    metrics_port — GET /metrics обработчика i на порту metrics_port + i."""
+    if workers < 2:
+        return False
+    if not reuse_port_supported():
+        print("SO_REUSEPORT недоступен — сервер запускается в одном процессе")
+        return False
+
+    snapshot = SharedSnapshot.create()
+    wakes = [multiprocessing.Pipe(duplex=False) for _ in range(workers)]
+    trigger_r, trigger_w = multiprocessing.Pipe(duplex=False)
+
+    procs = [multiprocessing.Process(target=_sampler_main, name=f"{cls.NAME}-sampler",
+                                     args=(cls, snapshot.buffer, [w for _, w in wakes], trigger_r))]
+    for i, (r, _) in enumerate(wakes):
+        procs.append(multiprocessing.Process(target=_worker_main, name=f"{cls.NAME}-worker-{i}",
+                                             args=(cls, host, port, i, snapshot.buffer, r, trigger_w, metrics_port)))
+
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    except (ValueError, AttributeError):
+        pass
+
+    print(f"{cls.NAME}: {workers} процессов-обработчиков на {host}:{port} и общий процесс опроса")
+    try:
+        for p in procs:
+            p.start()
+        # фоновый поток отправки логов запускается только после fork дочерних процессов
+        send_log(cls.SERVER_NAME, "INFO", f"Started {workers} workers on {host}:{port}")
+        for p in procs:
+            p.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join(5)
+    return True